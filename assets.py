@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import pygame
+from collections.abc import Mapping
+
+ATLASVERSION = 1
+ATLASWIDTH = 1024
+ASSETCACHE = ".assetcache"
+COLORKEY = (255, 0, 255)
+
+def loadSpriteSheet(path):
+    """Load in a sprite sheet image"""
+    image = pygame.image.load(path)
+    return image
+
+def spriteImage(spritesheet, size, xcoord, ycoord, width, height):
+    """Function to extract an individual image from a Sprite sheet"""
+    surface = pygame.Surface(size)
+    surface.fill("Black")
+    surface.blit(spritesheet, (0, 0), (xcoord, ycoord, width, height))
+    surface.set_colorkey("Black")
+    return surface
+
+def sliceImages(spriteSheet, numimghor=1, numimgver=1, scaleimage=False, scalesize=(64, 64), rotateimage=False, rotation=0, simg=False):
+    """Function to cut, scale and rotate all sprites of an already loaded sheet"""
+    spriteSheetWidth = spriteSheet.get_width()
+    spriteSheetHeight = spriteSheet.get_height()
+    spriteWidth = spriteSheetWidth // numimghor
+    spriteHeight = spriteSheetHeight // numimgver
+
+    imageList = []
+    for row in range(numimgver):
+        for col in range(numimghor):
+            if simg==True:
+                image = spriteSheet
+            else:
+                image = spriteImage(spriteSheet,
+                                    (spriteWidth, spriteHeight),
+                                    col * spriteWidth, row * spriteHeight,
+                                    spriteWidth, spriteHeight)
+            if scaleimage == True:
+                image = pygame.transform.scale(image, scalesize)
+            if rotateimage == True:
+                image = pygame.transform.rotate(image, rotation)
+            imageList.append(image)
+    return imageList
+
+def loadImages(path, *args, **kwargs):
+    """Function to collect all sprites from a sheet into a single list"""
+    return sliceImages(loadSpriteSheet(path), *args, **kwargs)
+
+def testLoadedImages(window, xstart, ystart, imgwidth, imgheight, imglist, imgdict):
+    """Test function to reflect all images on the game window."""
+    for row, num in enumerate(imglist):
+        for col, img in enumerate(imgdict[num]):
+            window.blit(img, (xstart + (imgwidth * col), ystart + (imgheight * row)))
+
+def _alphaImage(image):
+    """Copies an image into a per pixel alpha surface that blits identically, colorkey included"""
+    surface = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    if image.get_flags() & pygame.SRCALPHA:
+        surface.blit(image, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+    else:
+        surface.blit(image, (0, 0))
+    return surface
+
+def displayImage(image):
+    """Copy of an atlas frame in the pixel format of the display, which has to be set already.
+
+    Fully opaque frames lose their alpha channel, frames whose pixels are all either fully
+    transparent or fully opaque get an RLE accelerated colorkey and the rest keep per pixel alpha.
+    Returns the surface and which of "opaque", "colorkey" or "alpha" was used.
+    """
+    width, height = image.get_size()
+    opaque = pygame.mask.from_surface(image, 254).count()
+    if opaque == width * height:
+        return image.convert(), "opaque"
+    if pygame.mask.from_surface(image, 0).count() == opaque:
+        surface = pygame.Surface((width, height)).convert()
+        surface.fill(COLORKEY)
+        surface.blit(image, (0, 0))
+        #  Only usable when no visible pixel happens to have the colorkey color
+        if pygame.mask.from_threshold(surface, COLORKEY, (1, 1, 1, 255)).count() == width * height - opaque:
+            surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+            return surface, "colorkey"
+    return image.convert_alpha(), "alpha"
+
+def atlasKey(specs):
+    """Hash of the asset specs and the content of every source file they use"""
+    key = hashlib.sha256(f"{ATLASVERSION} {ATLASWIDTH} {specs!r}".encode())
+    for path in sorted({spec[0] for images in specs.values() for spec in images.values()}):
+        with open(path, "rb") as file:
+            key.update(file.read())
+    return key.hexdigest()[:16]
+
+def buildAtlas(specs):
+    """Decodes every sheet once, generates all sprites per the specs and packs them into one surface.
+
+    specs maps a set name to {key: (path, *loadImages arguments)}. Returns the atlas surface and an
+    index mapping set name -> key -> list of (x, y, width, height) rects into the atlas.
+    """
+    sheets = {}
+    images = []
+    for setName, setSpecs in specs.items():
+        for key, (path, *args) in setSpecs.items():
+            if path not in sheets:
+                sheets[path] = loadSpriteSheet(path)
+            for num, image in enumerate(sliceImages(sheets[path], *args)):
+                images.append((setName, key, num, _alphaImage(image)))
+
+    #  Shelf packing, tallest images first
+    rects = {}
+    x, y, shelfHeight = 0, 0, 0
+    for setName, key, num, image in sorted(images, key=lambda item: -item[3].get_height()):
+        width, height = image.get_size()
+        if x + width > ATLASWIDTH:
+            x, y, shelfHeight = 0, y + shelfHeight, 0
+        rects[(setName, key, num)] = (x, y, width, height)
+        x += width
+        shelfHeight = max(shelfHeight, height)
+
+    atlas = pygame.Surface((ATLASWIDTH, y + shelfHeight), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    index = {setName: {key: [] for key in setSpecs} for setName, setSpecs in specs.items()}
+    for setName, key, num, image in images:
+        rect = rects[(setName, key, num)]
+        atlas.blit(image, rect[:2], special_flags=pygame.BLEND_RGBA_MAX)
+        index[setName][key].append(rect)
+    return atlas, index
+
+def loadAtlas(specs, cachedir=ASSETCACHE):
+    """Loads the atlas for the specs from the disk cache, building and saving it on a cache miss"""
+    key = atlasKey(specs)
+    imagePath = os.path.join(cachedir, f"atlas-{key}.png")
+    indexPath = os.path.join(cachedir, f"atlas-{key}.json")
+    try:
+        with open(indexPath, "r") as file:
+            index = json.load(file)
+        atlas = pygame.image.load(imagePath)
+    except (OSError, ValueError, pygame.error):
+        atlas, index = buildAtlas(specs)
+        saveAtlas(atlas, index, imagePath, indexPath)
+    return atlas, index
+
+def saveAtlas(atlas, index, imagePath, indexPath):
+    """Writes the atlas and its index, skipping the cache quietly if it cannot be written"""
+    try:
+        os.makedirs(os.path.dirname(imagePath), exist_ok=True)
+        pygame.image.save(atlas, imagePath + ".tmp.png")
+        os.replace(imagePath + ".tmp.png", imagePath)
+        with open(indexPath + ".tmp", "w") as file:
+            json.dump(index, file)
+        os.replace(indexPath + ".tmp", indexPath)
+    except (OSError, pygame.error):
+        pass
+
+class AssetSet(Mapping):
+    """Read only view of one sprite set that is loaded on first lookup"""
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __getitem__(self, key):
+        return self.registry.load(self.name)[key]
+
+    def __iter__(self):
+        return iter(self.registry.specs[self.name])
+
+    def __len__(self):
+        return len(self.registry.specs[self.name])
+
+class AssetRegistry:
+    """Loads sprite sets from the atlas on first access instead of at import time"""
+    def __init__(self, specs, cachedir=ASSETCACHE):
+        self.specs = specs
+        self.cachedir = cachedir
+        self.atlas = None
+        self.index = None
+        self.sets = {}
+        self.converted = False
+        #  Frames of each converted set per display format, {name: {"opaque": count, ...}}
+        self.formats = {}
+
+    def __getitem__(self, name):
+        if name not in self.specs:
+            raise KeyError(name)
+        return AssetSet(self, name)
+
+    def load(self, name):
+        """Returns the sprite lists of a set, loading the atlas the first time any set is needed"""
+        images = self.sets.get(name)
+        if images is None:
+            if self.atlas is None:
+                self.atlas, self.index = loadAtlas(self.specs, self.cachedir)
+            images = {key: [self.atlas.subsurface(rect) for rect in rects] for key, rects in self.index[name].items()}
+            if self.converted:
+                images = self._convertSet(name, images)
+            self.sets[name] = images
+        return images
+
+    def _convertSet(self, name, images):
+        formats = {}
+        converted = {}
+        for key, frames in images.items():
+            converted[key] = []
+            for frame in frames:
+                image, kind = displayImage(frame)
+                converted[key].append(image)
+                formats[kind] = formats.get(kind, 0) + 1
+        self.formats[name] = formats
+        return converted
+
+    def convert(self):
+        """Converts every loaded frame to the display format, and every set loaded later as it is
+        loaded. Call after pygame.display.set_mode"""
+        if self.converted:
+            return
+        self.converted = True
+        for name, images in self.sets.items():
+            self.sets[name] = self._convertSet(name, images)
+
+    def warm(self, *names):
+        """Loads the given sets, or all of them, ahead of their first use"""
+        for name in names or self.specs:
+            self.load(name)
@@ -0,0 +1,173 @@
+"""Runs many headless games in parallel and streams one result per game to a CSV or JSONL file.
+
+    python batch.py --games 1000 --policy greedy --out results.jsonl --start-time 25000
+"""
+import argparse
+import csv
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from grid import TRANSITIONS, ARRIVED, TILECODES, EMPTY
+from simulation import PipeSimulation, Rules, PipeCell, STARTTIME, STAGETIME, FLOWTIME, STARTSCORE, PLACESCORE, PIPESCORE, WINSCORE
+from solver import Solver
+
+FIELDS = ["seed", "policy", "score", "stage", "pipeLength", "failReason", "simTime"]
+THINKTIME = 250
+MAXSTAGES = 50
+MAXSIMTIME = 60 * 60 * 1000
+
+def _emptyCells(sim):
+    return [(row, col) for row in range(sim.rows) for col in range(sim.cols) if sim.grid.isEmpty(row, col)]
+
+def randomPolicy(sim, rng, thinktime=THINKTIME):
+    """Drops pieces on random empty cells until a third of the board is used, then presses Ready"""
+    if len(sim.pieces) - 2 >= (sim.rows * sim.cols) // 3:
+        return "ready"
+    cells = _emptyCells(sim)
+    return rng.choice(cells) if cells else "ready"
+
+def greedyPolicy(sim, rng, thinktime=THINKTIME):
+    """Makes the first move of the solver toward the end piece, with a move every thinktime ms, and
+    presses Ready once the route is connected. When the end is out of reach it extends the pipe
+    with every piece that fits and discards the others out of the way"""
+    path = sim.path
+    if path.state != "open":
+        return "ready"
+    solver = Solver.fromSimulation(sim, thinktime)
+    solver.run()
+    if solver.moves:
+        move = solver.moves[0]
+        if move[0] == "place":
+            return move[1:3]
+        if move[0] == "remove":
+            return move
+        cell = solver.discardCell(sim.grid)
+        if cell is not None:
+            return cell
+    return _extendPolicy(sim, rng)
+
+def _extendPolicy(sim, rng):
+    path = sim.path
+    row, col = path.nextCell
+    direction = path.direction
+    transition = TRANSITIONS[direction][TILECODES[sim.currentPiece]]
+    if transition is not None:
+        exit, dRow, dCol, _ = transition
+        nextCode = sim.grid.get(row + dRow, col + dCol)
+        nextTransition = TRANSITIONS[exit][nextCode]
+        if nextCode == EMPTY or (nextTransition is not None and nextTransition[0] == ARRIVED):
+            return row, col
+    cells = [(r, c) for r, c in _emptyCells(sim) if abs(r - row) + abs(c - col) > 1]
+    return rng.choice(cells) if cells else "ready"
+
+POLICIES = {
+    "random": randomPolicy,
+    "greedy": greedyPolicy
+}
+
+def simulateGame(seed, policy="greedy", rows=12, cols=12, rules=None, thinktime=THINKTIME, maxstages=MAXSTAGES):
+    """Plays one full game with a placement policy and returns its result row"""
+    rng = random.Random(seed)
+    act = POLICIES[policy]
+    sim = PipeSimulation(rows, cols, rules=rules)
+    sim.new_game(seed)
+
+    pipeLength = 0
+    nextThink = sim.clock.ticks()
+    readyPressed = False
+    failReason = None
+    while True:
+        if sim.clock.ticks() >= nextThink:
+            action = act(sim, rng, thinktime)
+            if action == "ready":
+                if not readyPressed:
+                    sim.ready()
+                    readyPressed = True
+            elif action is not None and action[0] == "remove":
+                sim.removePiece(*action[1:])
+            elif action is not None:
+                sim.insert_new_piece(*action)
+            nextThink += thinktime
+
+        sim.clock.advance(sim.rules.flowTime)
+        sim.update()
+
+        if sim.gameOver or sim.stageClear:
+            pipeLength += sum(1 for cell in sim.pieces.values() if isinstance(cell, PipeCell) and cell.direction is not None)
+        if sim.gameOver:
+            failReason = sim.failReason
+            break
+        if sim.stageClear:
+            if sim.stage + 1 >= maxstages:
+                failReason = "max_stages"
+                break
+            sim.next_stage()
+            nextThink = sim.clock.ticks()
+            readyPressed = False
+        if sim.clock.ticks() >= MAXSIMTIME:
+            failReason = "max_time"
+            break
+
+    return {
+        "seed": seed,
+        "policy": policy,
+        "score": sim.Score,
+        "stage": sim.stage,
+        "pipeLength": pipeLength,
+        "failReason": failReason,
+        "simTime": sim.clock.ticks()
+    }
+
+def _simulate(args):
+    return simulateGame(*args)
+
+def runBatch(seeds, out, policy="greedy", rows=12, cols=12, rules=None, workers=None, chunksize=16,
+             thinktime=THINKTIME):
+    """Simulates a game per seed across a process pool, writing each result as it arrives"""
+    jobs = ((seed, policy, rows, cols, rules, thinktime) for seed in seeds)
+    with open(out, "w", newline="") as file, ProcessPoolExecutor(workers) as executor:
+        if out.endswith(".csv"):
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda result: file.write(json.dumps(result) + "\n")
+        count = 0
+        for result in executor.map(_simulate, jobs, chunksize=chunksize):
+            write(result)
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many pipes games without a window")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="first seed, games use seed .. seed + games - 1")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy")
+    parser.add_argument("--rows", type=int, default=12)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--think-time", type=int, default=THINKTIME, help="ms between the moves of the policy")
+    parser.add_argument("--out", default="results.jsonl", help="output file, .csv or .jsonl")
+    parser.add_argument("--start-time", type=int, default=STARTTIME)
+    parser.add_argument("--stage-time", type=int, default=STAGETIME)
+    parser.add_argument("--flow-time", type=int, default=FLOWTIME)
+    parser.add_argument("--start-score", type=int, default=STARTSCORE)
+    parser.add_argument("--place-score", type=int, default=PLACESCORE)
+    parser.add_argument("--pipe-score", type=int, default=PIPESCORE)
+    parser.add_argument("--win-score", type=int, default=WINSCORE)
+    parser.add_argument("--min-distance", type=int, default=0, help="start to end distance on the first stage")
+    parser.add_argument("--max-distance", type=int, default=None)
+    parser.add_argument("--distance-step", type=int, default=0, help="added to the minimum distance each stage")
+    args = parser.parse_args()
+
+    rules = Rules(args.start_time, args.stage_time, args.flow_time, args.start_score,
+                  args.place_score, args.pipe_score, args.win_score, args.min_distance,
+                  args.max_distance, args.distance_step)
+    seeds = range(args.seed, args.seed + args.games)
+    count = runBatch(seeds, args.out, args.policy, args.rows, args.cols, rules, args.workers,
+                     thinktime=args.think_time)
+    print(f"{count} games written to {args.out}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Benchmarks of asset loading, sprite blits, drawing and the flow update, run without a window.
+
+    python bench.py --out bench.json                        # run and save the results
+    python bench.py --compare bench.json                    # run and compare against a baseline
+
+Metrics ending in _ms are better lower, those ending in _fps better higher. Each is the best of
+REPEATS runs to keep noise out of the comparison. In compare mode every metric that got worse by
+more than --threshold percent is reported and the exit status is 1; _ms metrics also have to get
+worse by at least --min-delta ms, as sub millisecond timings jitter by more than 10%. Other metrics,
+like the number of frames converted to each display format, are reported but not compared.
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+import pygame
+
+import main as pipes
+from assets import AssetRegistry, loadImages
+from grid import TRANSITIONS, TILECODES
+from simulation import PipeSimulation, PIPEPIECES
+
+GRIDSIZES = (12, 24, 48, 100)
+DRAWFRAMES = 120
+CHAINSIZE = 24
+CHAINTRIES = 200
+FRAMETIME = 16
+BLITS = 1000
+THRESHOLD = 10
+MINDELTA = 1.0
+REPEATS = 5
+
+def _timed(function, *args):
+    """Fastest of REPEATS calls in ms"""
+    best = None
+    for _ in range(REPEATS):
+        start = perf_counter()
+        function(*args)
+        elapsed = (perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchAssets(results):
+    """Every loadImages call of the game's asset specs, then the atlas registry cold and warm"""
+    total = 0
+    for name, specs in pipes.ASSETSPECS.items():
+        for key, (path, *args) in specs.items():
+            elapsed = _timed(loadImages, path, *args)
+            results[f"assets.loadImages.{name}.{key}_ms"] = elapsed
+            total += elapsed
+    results["assets.loadImages.total_ms"] = total
+    results["assets.registry.cold_ms"] = _timed(_coldRegistry)
+    with tempfile.TemporaryDirectory() as cachedir:
+        AssetRegistry(pipes.ASSETSPECS, cachedir).warm()
+        results["assets.registry.warm_ms"] = _timed(lambda: AssetRegistry(pipes.ASSETSPECS, cachedir).warm())
+
+def benchBlits(screen, results):
+    """Time of BLITS blits of the frames of every sprite set onto the display, as loaded from
+    the atlas and after conversion to the display format, and how many frames of each set were
+    converted to each of the opaque, colorkey and alpha formats"""
+    registry = AssetRegistry(pipes.ASSETSPECS)
+    registry.warm()
+    before = {name: _frames(registry, name) for name in pipes.ASSETSPECS}
+    results["assets.registry.warm_converted_ms"] = _timed(_convertRegistry)
+    registry.convert()
+    for name in pipes.ASSETSPECS:
+        results[f"blit.{name}.loaded_ms"] = _timed(_blitFrames, screen, before[name])
+        results[f"blit.{name}.converted_ms"] = _timed(_blitFrames, screen, _frames(registry, name))
+        for kind, count in registry.formats[name].items():
+            results[f"assets.formats.{name}.{kind}"] = count
+
+def _frames(registry, name):
+    return [frame for frames in registry.load(name).values() for frame in frames]
+
+def _blitFrames(screen, frames):
+    width = screen.get_width() - 64
+    for num in range(BLITS):
+        screen.blit(frames[num % len(frames)], ((num * 7) % width, 64))
+
+def _convertRegistry():
+    registry = AssetRegistry(pipes.ASSETSPECS)
+    registry.warm()
+    registry.convert()
+
+def _coldRegistry():
+    with tempfile.TemporaryDirectory() as cachedir:
+        AssetRegistry(pipes.ASSETSPECS, cachedir).warm()
+
+def _gameplay(game, seed, size):
+    """Gameplay on a size x size board in a new game of seed that never saves a top score"""
+    gameplay = pipes.PipeGamePlay(seed, game.profiler, size, size, saveScores=False)
+    gameplay.new_game(seed)
+    return gameplay
+
+def _fill(gameplay):
+    """Places a pipe on every empty cell"""
+    sim = gameplay.sim
+    for row in range(sim.rows):
+        for col in range(sim.cols):
+            gameplay.place(row, col)
+    gameplay.handle_events()
+
+def benchDraw(game, results):
+    """Full redraws per second of Game.draw on boards full of pipes"""
+    game.dirtyRendering = False
+    for size in GRIDSIZES:
+        game.gameplay = _gameplay(game, 0, size)
+        _fill(game.gameplay)
+        game.draw()
+        elapsed = _timed(_drawFrames, game) / 1000
+        results[f"draw.{size}x{size}_fps"] = DRAWFRAMES / elapsed
+
+def _drawFrames(game):
+    for _ in range(DRAWFRAMES):
+        game.draw()
+
+def _chain(sim, rng):
+    """Lays pipes from the start piece along a random walk until it gets stuck, returns the
+    placements as (piece, row, col)"""
+    moves = []
+    path = sim.path
+    while path.state == "open":
+        row, col = path.nextCell
+        choices = []
+        for piece in PIPEPIECES:
+            transition = TRANSITIONS[path.direction][TILECODES[piece]]
+            if transition is None:
+                continue
+            exit, dRow, dCol, _ = transition
+            if sim.grid.isEmpty(row + dRow, col + dCol):
+                choices.append(piece)
+        if not choices:
+            break
+        sim.currentPiece = rng.choice(choices)
+        moves.append((sim.currentPiece, row, col))
+        sim.insert_new_piece(row, col)
+    return moves
+
+def benchUpdate(game, results):
+    """PipeGamePlay.update while the water runs down the longest random chain found"""
+    rng = random.Random(0)
+    best = (-1, None, None)
+    for seed in range(CHAINTRIES):
+        sim = PipeSimulation(CHAINSIZE, CHAINSIZE, seed=seed)
+        sim.new_game(seed)
+        moves = _chain(sim, rng)
+        if len(moves) > best[0]:
+            best = (len(moves), seed, moves)
+    length, seed, moves = best
+    gameplay = _gameplay(game, seed, CHAINSIZE)
+    for piece, row, col in moves:
+        gameplay.sim.currentPiece = piece
+        gameplay.place(row, col)
+    gameplay.handle_events()
+    game.gameplay = gameplay
+    sim = gameplay.sim
+    clock = gameplay.clock
+    gameplay.ready()
+
+    times = []
+    while not sim.gameOver and not sim.stageClear:
+        clock.now += FRAMETIME
+        start = perf_counter()
+        gameplay.update()
+        times.append((perf_counter() - start) * 1000)
+    times.sort()
+    results["update.chain_length"] = length
+    results["update.frames"] = len(times)
+    results["update.median_ms"] = times[len(times) // 2]
+    results["update.p95_ms"] = times[int(len(times) * 0.95)]
+
+def run():
+    results = {}
+    benchAssets(results)
+    game = pipes.Game()
+    benchBlits(game.screen, results)
+    benchDraw(game, results)
+    benchUpdate(game, results)
+    pygame.quit()
+    return results
+
+def compare(results, baseline, threshold=THRESHOLD, mindelta=MINDELTA):
+    """Prints every metric against the baseline, returns the names of those that regressed"""
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None or not (name.endswith("_ms") or name.endswith("_fps")):
+            print(f"{name:<44}{value:>12.3f}")
+            continue
+        change = (value - old) / old * 100 if old else 0.0
+        if name.endswith("_ms"):
+            worse = change > threshold and value - old >= mindelta
+        else:
+            worse = change < -threshold
+        if worse:
+            regressions.append(name)
+        print(f"{name:<44}{value:>12.3f}{old:>12.3f}{change:>+9.1f}%{'  REGRESSION' if worse else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark asset loading, drawing and updates")
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="percent change counted as a regression")
+    parser.add_argument("--min-delta", type=float, default=MINDELTA, help="smallest ms increase counted as a regression")
+    args = parser.parse_args()
+
+    results = run()
+    if args.out is not None:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare is None:
+        for name, value in results.items():
+            print(f"{name:<44}{value:>12.3f}")
+        return 0
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold}%")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Route the water will take from the start piece over the pipes placed so far.
+
+The path is walked once when a stage starts and then kept up to date from the changed cell only:
+placing a piece on the cell the path stops at extends it from there, removing a piece on the path
+cuts it back to that cell. Placing or removing anywhere else cannot change the route.
+"""
+from grid import TRANSITIONS, STARTTRANSITIONS, ARRIVED, EMPTY, OFFBOARD, TILECODES
+
+#  Flow steps, FLOWTIME apart, between the water entering a cell and it moving on to the next one
+STARTSTEPS = 9
+PIPESTEPS = 11
+
+class FlowPath:
+    def __init__(self, grid, startcell):
+        self.grid = grid
+        self.startRow = startcell.row
+        self.startCol = startcell.col
+        self.startTransition = STARTTRANSITIONS[TILECODES[startcell.piece]]
+        self.rebuild()
+
+    def rebuild(self):
+        """Walks the whole path again from the start piece"""
+        self.cells = []
+        self.index = {}
+        self._walk()
+
+    def _walk(self):
+        """Extends the path from its last cell until the water reaches the end or cannot go further"""
+        if self.cells:
+            row, col, transition = self.cells[-1]
+        else:
+            row, col, transition = self.startRow, self.startCol, self.startTransition
+        while True:
+            direction, dRow, dCol, _ = transition
+            row, col = row + dRow, col + dCol
+            code = self.grid.get(row, col)
+            transition = TRANSITIONS[direction][code]
+            self.direction = direction
+            self.nextCell = (row, col)
+            if transition is None or (row, col) in self.index:
+                if code == EMPTY:
+                    self.state = "open"
+                elif code == OFFBOARD:
+                    self.state = "edge"
+                else:
+                    self.state = "blocked"
+                return
+            if transition[0] == ARRIVED:
+                self.state = "connected"
+                return
+            self.index[(row, col)] = len(self.cells)
+            self.cells.append((row, col, transition))
+
+    def update(self, row, col):
+        """Brings the path up to date after the piece at (row, col) was placed or removed"""
+        if (row, col) == self.nextCell:
+            self._walk()
+            return
+        position = self.index.get((row, col))
+        if position is None:
+            return
+        for cutRow, cutCol, _ in self.cells[position:]:
+            del self.index[(cutRow, cutCol)]
+        del self.cells[position:]
+        self._walk()
+
+    @property
+    def length(self):
+        """Number of pipes the water will flow through"""
+        return len(self.cells)
+
+    @property
+    def connected(self):
+        return self.state == "connected"
+
+    @property
+    def brokenCell(self):
+        """First cell the water cannot flow into, None when the path reaches the end piece"""
+        return None if self.connected else self.nextCell
+
+    def flowSchedule(self, flowstart, flowtime):
+        """Time the water enters each pipe of the path if the start piece begins flowing at flowstart.
+
+        Returns ([(row, col, entry time), ...], finish time) where finish time is when the water
+        reaches the end piece or the broken cell.
+        """
+        time = flowstart + STARTSTEPS * flowtime
+        schedule = []
+        for row, col, _ in self.cells:
+            schedule.append((row, col, time))
+            time += PIPESTEPS * flowtime
+        return schedule, time
@@ -0,0 +1,113 @@
+"""Compact game grid: one byte per cell holding a small integer tile code.
+
+Each tile code has a connectivity bitmask with one bit per open side, so checking whether water can
+pass between two cells is a couple of bit tests. TILENAMES/TILECODES translate between the codes and
+the piece names used by the rest of the game ("LR-RL", "SRIGHT", " " ...).
+"""
+from array import array
+
+LEFT = 1
+RIGHT = 2
+UP = 4
+DOWN = 8
+
+SIDES = {"LEFT": LEFT, "RIGHT": RIGHT, "UP": UP, "DOWN": DOWN}
+OPPOSITE = {LEFT: RIGHT, RIGHT: LEFT, UP: DOWN, DOWN: UP}
+
+EMPTY = 0
+OFFBOARD = 255
+
+#  Code order: empty, pipes, start pieces, end pieces
+TILENAMES = [" ",
+             "LR-RL", "TB-BT", "LT-TL", "LB-BL", "RT-TR", "RB-BR",
+             "SRIGHT", "SLEFT", "SUP", "SDOWN",
+             "ERIGHT", "ELEFT", "EUP", "EDOWN"]
+TILECODES = {name: code for code, name in enumerate(TILENAMES)}
+FIRSTPIPE, LASTPIPE = TILECODES["LR-RL"], TILECODES["RB-BR"]
+FIRSTSTART, LASTSTART = TILECODES["SRIGHT"], TILECODES["SDOWN"]
+FIRSTEND, LASTEND = TILECODES["ERIGHT"], TILECODES["EDOWN"]
+
+_SIDELETTERS = {"L": LEFT, "R": RIGHT, "T": UP, "B": DOWN}
+
+def _connections(name):
+    """Open sides of a tile. End pieces are named after the direction the water arrives in"""
+    if name == " ":
+        return 0
+    if name[0] == "S":
+        return SIDES[name[1:]]
+    if name[0] == "E":
+        return OPPOSITE[SIDES[name[1:]]]
+    return _SIDELETTERS[name[0]] | _SIDELETTERS[name[1]]
+
+CONNECTIONS = array("B", [_connections(name) for name in TILENAMES] + [0] * (256 - len(TILENAMES)))
+
+def isPipe(code):
+    return FIRSTPIPE <= code <= LASTPIPE
+
+def isStart(code):
+    return FIRSTSTART <= code <= LASTSTART
+
+def isEnd(code):
+    return FIRSTEND <= code <= LASTEND
+
+#  Water flow transitions. Directions are the side bit the water travels towards.
+OFFSETS = {LEFT: (0, -1), RIGHT: (0, 1), UP: (-1, 0), DOWN: (1, 0)}
+_LETTERS = {LEFT: "L", RIGHT: "R", UP: "T", DOWN: "B"}
+ARRIVED = 0
+
+def _transition(direction, code):
+    """(exit direction, row offset, col offset, flow animation key) for water travelling in direction
+    into a tile, ARRIVED as exit for a matching end piece and None when the water cannot get in"""
+    entry = OPPOSITE[direction]
+    if isStart(code) or not CONNECTIONS[code] & entry:
+        return None
+    if isEnd(code):
+        return (ARRIVED, 0, 0, None)
+    exit = CONNECTIONS[code] & ~entry
+    return (exit, OFFSETS[exit][0], OFFSETS[exit][1], _LETTERS[entry] + _LETTERS[exit])
+
+#  TRANSITIONS[direction][code]; OFFBOARD has no connections so the water never leaves the grid
+TRANSITIONS = {direction: [_transition(direction, code) for code in range(256)] for direction in OFFSETS}
+#  STARTTRANSITIONS[code] for the start pieces, in the same layout
+STARTTRANSITIONS = [(CONNECTIONS[code], *OFFSETS[CONNECTIONS[code]], None) if isStart(code) else None for code in range(256)]
+
+class TileGrid:
+    """rows x cols tile codes stored row major in a flat byte array, indexed by row * cols + col"""
+    def __init__(self, rows, cols, cells=None):
+        self.rows = rows
+        self.cols = cols
+        self.cells = array("B", bytes(rows * cols)) if cells is None else cells
+
+    def inside(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def get(self, row, col):
+        """Tile code at a cell, OFFBOARD outside of the grid"""
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self.cells[row * self.cols + col]
+        return OFFBOARD
+
+    def set(self, row, col, code):
+        self.cells[row * self.cols + col] = code
+
+    def name(self, row, col):
+        """Piece name at a cell, None outside of the grid"""
+        code = self.get(row, col)
+        return None if code == OFFBOARD else TILENAMES[code]
+
+    def setName(self, row, col, name):
+        self.set(row, col, TILECODES[name])
+
+    def opens(self, row, col, side):
+        """Whether the tile at a cell has an opening on side (LEFT, RIGHT, UP or DOWN)"""
+        return bool(CONNECTIONS[self.get(row, col)] & side)
+
+    def isEmpty(self, row, col):
+        return self.get(row, col) == EMPTY
+
+    def copy(self):
+        return TileGrid(self.rows, self.cols, array("B", self.cells))
+
+    def toNames(self):
+        """Grid as a list of rows of piece names, the layout the game used before"""
+        return [[TILENAMES[code] for code in self.cells[row * self.cols:(row + 1) * self.cols]] for row in range(self.rows)]
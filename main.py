@@ -1,8 +1,13 @@
+import argparse
 import pygame
-from random import choice, randint
+from collections import OrderedDict
+from time import perf_counter
 
-pygame.init()
-pygame.display.init()
+from assets import AssetRegistry
+from profiler import FrameProfiler, PHASES
+from replay import Recorder, Replay, cellArg
+from simulation import GameClock, PipeSimulation, SEEDRANGE
+from solver import Solver
 
 #  Utility functions
 def loadTopScore():
@@ -18,137 +23,473 @@ def saveTopScore(topscore, totalscore):
         with open('TopScore.txt', 'w') as file:
             file.write(f'TopScore = {str(totalscore)}')
 
-def loadSpriteSheet(path):
-    """Load in a sprite sheet image"""
-    image = pygame.image.load(path)
-    return image
-
-def spriteImage(spritesheet, size, xcoord, ycoord, width, height):
-    """Function to extract an individual image from a Sprite sheet"""
-    surface = pygame.Surface(size)
-    surface.fill("Black")
-    surface.blit(spritesheet, (0, 0), (xcoord, ycoord, width, height))
-    surface.set_colorkey("Black")
-    return surface
-
-def loadImages(path, numimghor=1, numimgver=1, scaleimage=False, scalesize=(64, 64), rotateimage=False, rotation=0, simg=False):
-    """Function to collect all sprites from a sheet into a single list"""
-    spriteSheet = loadSpriteSheet(path)
-    spriteSheetWidth = spriteSheet.get_width()
-    spriteSheetHeight = spriteSheet.get_height()
-    spriteWidth = spriteSheetWidth // numimghor
-    spriteHeight = spriteSheetHeight // numimgver
-
-    imageList = []
-    for row in range(numimgver):
-        for col in range(numimghor):
-            if simg==True:
-                image = spriteSheet
-            else:
-                image = spriteImage(spriteSheet,
-                                    (spriteWidth, spriteHeight),
-                                    col * spriteWidth, row * spriteHeight,
-                                    spriteWidth, spriteHeight)
-            if scaleimage == True:
-                image = pygame.transform.scale(image, scalesize)
-            if rotateimage == True:
-                image = pygame.transform.rotate(image, rotation)
-            imageList.append(image)
-    return imageList
-
-def testLoadedImages(window, xstart, ystart, imgwidth, imgheight, imglist, imgdict):
-    """Test function to reflect all images on the game window."""
-    for row, num in enumerate(imglist):
-        for col, img in enumerate(imgdict[num]):
-            window.blit(img, (xstart + (imgwidth * col), ystart + (imgheight * row)))
-
-def textImage(font, message):
-    message = font.render(message, 1, "White")
-    return message
+class TextCache:
+    """Least recently used cache of rendered text surfaces keyed by (font, message, color)"""
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.images = OrderedDict()
+
+    def render(self, font, message, color):
+        key = (font, message, color)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+        image = font.render(message, 1, color)
+        self.images[key] = image
+        if len(self.images) > self.maxsize:
+            self.images.popitem(last=False)
+        return image
+
+def textImage(font, message, color="White"):
+    return TEXTCACHE.render(font, message, color)
+
+class FontCache:
+    """Font objects shared by the whole game, keyed by (family, size).
+
+    Each family is looked up among the system fonts only once; a family that is not installed falls
+    back to the default font bundled with pygame, as SysFont would.
+    """
+    def __init__(self):
+        self.paths = {}
+        self.fonts = {}
+
+    def get(self, family, size):
+        font = self.fonts.get((family, size))
+        if font is None:
+            if family not in self.paths:
+                self.paths[family] = pygame.font.match_font(family)
+            font = pygame.font.Font(self.paths[family], size)
+            self.fonts[(family, size)] = font
+        return font
+
+def getFont(size, family=None):
+    return FONTS.get(FONTFAMILY if family is None else family, size)
 
 #  Classes
 class Game:
-    def __init__(self):
+    def __init__(self, fps=None, idlefps=None, seed=None, record=None, replay=None, profile=None, speed=1.0,
+                 rows=None, cols=None):
+        pygame.init()
+
         self.sw = SCREENWIDTH
         self.sh = SCREENHEIGHT
 
         self.screen = pygame.display.set_mode((self.sw, self.sh))
         pygame.display.set_caption("Pipes")
-
-        self.gameplay = PipeGamePlay()
+        ASSETS.warm()
+        ASSETS.convert()
+
+        self.replay = None if replay is None else Replay(replay)
+        if self.replay is not None:
+            seed, rows, cols = self.replay.seed, self.replay.rows, self.replay.cols
+        self.profiler = FrameProfiler(csvpath=profile)
+        #  Replayed games never save a top score
+        self.gameplay = PipeGamePlay(seed, self.profiler, rows, cols, saveScores=self.replay is None)
+        self.gameplay.clock.speed = speed
+        if self.replay is not None:
+            self.gameplay.clock.now = self.replay.start
+            self.gameplay.replaying = True
+        if record is not None:
+            self.gameplay.recorder = Recorder(record, self.gameplay.rows, self.gameplay.cols, self.gameplay.sim.seed, self.gameplay.clock.now)
+
+        self.clock = pygame.time.Clock()
+        self.fps = FPS if fps is None else fps
+        self.idleFps = IDLEFPS if idlefps is None else idlefps
+        self.focused = True
+        self.showFrameTime = False
+        self.showProfile = False
+        self.profileImage = None
+        self.profileTime = 0
+        self.dirtyRendering = DIRTYRECTS
+        self.frameFont = getFont(20)
 
         self.run = True
 
     def runGame(self):
+        profiler = self.profiler
         while self.run:
+            start = profiler.begin()
+            self.frame()
+            #  Clock tick, replayed actions and the log frame record
+            start = profiler.lap("clock", start)
             self.input()
+            start = profiler.lap("input", start)
             self.update()
+            profiler.lap("update", start)
             self.draw()
+            profiler.end()
+            self.clock.tick(self.targetFps())
+        if self.gameplay.recorder is not None:
+            self.gameplay.recorder.close()
+        profiler.close()
+
+    def frame(self):
+        """Ticks the game clock to the time everything in this frame sees and applies the replayed
+        actions due by then"""
+        gameplay = self.gameplay
+        clock = gameplay.clock
+        previous = clock.now
+        now = clock.tick()
+        if self.replay is not None:
+            clock.now = previous
+            self.replay.feed(gameplay, gameplay.sim, now)
+            #  Hold the simulation at the frame a pending action was recorded after
+            now = min(now, self.replay.nextUpdate)
+            clock.now = now
+        if gameplay.recorder is not None:
+            gameplay.recorder.frame(now)
+
+    def targetFps(self):
+        """Frame rate to pace the next frame at, dropping to the idle rate on static screens"""
+        sim = self.gameplay.sim
+        if not self.focused or self.gameplay.clock.paused or sim.newGame or sim.gameOver or sim.stageClear:
+            return self.idleFps
+        return self.fps
 
     def input(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.run = False
 
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if not self.gameplay.stageClear and not self.gameplay.gameOver and not self.gameplay.newGame:
+            if event.type == pygame.WINDOWFOCUSLOST:
+                self.focused = False
+            if event.type == pygame.WINDOWFOCUSGAINED:
+                self.focused = True
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.showFrameTime = not self.showFrameTime
+                self.gameplay.markDirty(self.frame_time_rect())
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                self.showProfile = not self.showProfile
+                self.profileTime = 0
+                self.gameplay.markDirty(self.profile_rect())
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                self.dirtyRendering = not self.dirtyRendering
+                self.gameplay.markDirty(self.screen.get_rect())
+
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_p, pygame.K_LEFTBRACKET, pygame.K_RIGHTBRACKET, pygame.K_PERIOD):
+                self.gameplay.control_clock(event.key)
+
+            if event.type == pygame.KEYDOWN and event.key in SCROLLKEYS:
+                dCol, dRow = SCROLLKEYS[event.key]
+                cellSize = self.gameplay.camera.cellSize
+                self.gameplay.scroll(dCol * cellSize, dRow * cellSize)
+
+            if event.type == pygame.MOUSEWHEEL and event.y:
+                self.gameplay.zoom(1 if event.y > 0 else -1, pygame.mouse.get_pos())
+
+            if event.type == pygame.MOUSEMOTION and event.buttons[1]:
+                self.gameplay.scroll(-event.rel[0], -event.rel[1])
+
+            if event.type == pygame.MOUSEBUTTONDOWN and self.replay is None:
+                sim = self.gameplay.sim
+                xPos, yPos = event.pos
+                if not sim.stageClear and not sim.gameOver and not sim.newGame and not self.gameplay.clock.paused:
                     if event.button == 1:
-                        xPos, yPos = pygame.mouse.get_pos()
-                        self.gameplay.insert_new_piece(xPos, yPos, XOFFSET, YOFFSET)
+                        self.gameplay.insert_new_piece(xPos, yPos)
 
                     if event.button == 3:
-                        xPos, yPos = pygame.mouse.get_pos()
-                        self.gameplay.removePiece(xPos, yPos, XOFFSET, YOFFSET)
+                        self.gameplay.removePiece(xPos, yPos)
 
                 for button in self.gameplay.buttons:
-                    if button.rect.collidepoint(pygame.mouse.get_pos()):
+                    if button.rect.collidepoint(event.pos):
                         button.buttonAction()
 
     def update(self):
         self.gameplay.update()
 
     def draw(self):
+        if self.dirtyRendering:
+            if self.showProfile:
+                self.gameplay.markDirty(self.profile_rect())
+            rects = self.gameplay.draw_dirty(self.screen)
+            if self.showFrameTime:
+                rects.append(self.draw_frame_time(self.screen))
+            if self.showProfile:
+                self.draw_profile(self.screen)
+            start = perf_counter()
+            pygame.display.update(rects)
+            self.profiler.lap("display", start)
+            return
+
         self.screen.fill("Black")
         self.gameplay.draw(self.screen)
+        if self.showFrameTime:
+            self.draw_frame_time(self.screen)
+        if self.showProfile:
+            self.draw_profile(self.screen)
+        start = perf_counter()
         pygame.display.update()
+        self.profiler.lap("display", start)
+
+    def frame_time_rect(self):
+        return pygame.Rect(0, self.sh - 32, self.sw, 32)
+
+    def draw_frame_time(self, window):
+        rect = self.frame_time_rect()
+        window.fill("Black", rect)
+        message = f"{self.clock.get_rawtime()} ms / {self.clock.get_time()} ms  {self.clock.get_fps():.0f} FPS"
+        window.blit(textImage(self.frameFont, message), (12, self.sh - 28))
+        return rect
+
+    def profile_rect(self):
+        return pygame.Rect(self.sw - 330, YOFFSET, 330, 22 * (len(PHASES) + 2) + 8)
+
+    def draw_profile(self, window):
+        """Draws the p50/p95/p99 phase timings, re-rendered every PROFILEREFRESH ms"""
+        rect = self.profile_rect()
+        now = pygame.time.get_ticks()
+        if self.profileImage is None or now - self.profileTime >= PROFILEREFRESH:
+            self.profileTime = now
+            self.profileImage = pygame.Surface(rect.size, pygame.SRCALPHA)
+            self.profileImage.fill((0, 0, 0, 200))
+            lines = ["phase          p50    p95    p99 ms"]
+            for phase, (p50, p95, p99) in self.profiler.summary().items():
+                lines.append(f"{phase:<12}{p50:>6.2f} {p95:>6.2f} {p99:>6.2f}")
+            for num, line in enumerate(lines):
+                self.profileImage.blit(self.frameFont.render(line, True, "White"), (8, 4 + 22 * num))
+        window.blit(self.profileImage, rect)
+        return rect
+
+class Camera:
+    """Scrollable, zoomable view of the board through the viewport area of the screen.
+
+    x and y are the board pixel, at the current cell size, shown at the top left corner of the
+    viewport. Every mapping between cells and screen pixels goes through here, so drawing only
+    touches the cells inside the viewport however large the board is.
+    """
+    def __init__(self, viewport, rows, cols, cellsize=None):
+        self.viewport = pygame.Rect(viewport)
+        self.rows = rows
+        self.cols = cols
+        self.cellSize = CELLSIZE if cellsize is None else cellsize
+        self.x = 0
+        self.y = 0
+
+    def _clamp(self):
+        self.x = max(0, min(self.x, self.cols * self.cellSize - self.viewport.width))
+        self.y = max(0, min(self.y, self.rows * self.cellSize - self.viewport.height))
+
+    def scroll(self, dx, dy):
+        """Moves the view by dx, dy pixels, returns whether it moved"""
+        old = (self.x, self.y)
+        self.x += dx
+        self.y += dy
+        self._clamp()
+        return (self.x, self.y) != old
+
+    def zoom(self, cellsize, focus=None):
+        """Changes the cell size keeping the board point under the screen point focus, the middle
+        of the viewport by default, in place. Returns whether the view changed"""
+        if cellsize == self.cellSize:
+            return False
+        xFocus, yFocus = self.viewport.center if focus is None else focus
+        xFocus -= self.viewport.x
+        yFocus -= self.viewport.y
+        self.x = (self.x + xFocus) * cellsize // self.cellSize - xFocus
+        self.y = (self.y + yFocus) * cellsize // self.cellSize - yFocus
+        self.cellSize = cellsize
+        self._clamp()
+        return True
+
+    def centerOn(self, row, col):
+        half = self.cellSize // 2
+        self.x = col * self.cellSize + half - self.viewport.width // 2
+        self.y = row * self.cellSize + half - self.viewport.height // 2
+        self._clamp()
+
+    def cellPos(self, row, col):
+        """Screen position of the top left corner of a cell"""
+        return self.viewport.x - self.x + col * self.cellSize, self.viewport.y - self.y + row * self.cellSize
+
+    def cellRect(self, row, col):
+        return pygame.Rect(self.cellPos(row, col), (self.cellSize, self.cellSize))
+
+    def cellAt(self, xpos, ypos):
+        """Cell under a screen point, (-1, -1) outside the viewport"""
+        if not self.viewport.collidepoint(xpos, ypos):
+            return -1, -1
+        return (ypos - self.viewport.y + self.y) // self.cellSize, (xpos - self.viewport.x + self.x) // self.cellSize
+
+    def boardRect(self):
+        """Screen area the board is visible in"""
+        return pygame.Rect(self.cellPos(0, 0), (self.cols * self.cellSize, self.rows * self.cellSize)).clip(self.viewport)
+
+    def cellRange(self, area):
+        """Rows and columns of the visible cells overlapping a screen area"""
+        area = area.clip(self.boardRect())
+        if not area:
+            return range(0), range(0)
+        firstRow, firstCol = self.cellAt(area.left, area.top)
+        lastRow, lastCol = self.cellAt(area.right - 1, area.bottom - 1)
+        return range(firstRow, lastRow + 1), range(firstCol, lastCol + 1)
+
+class BoardLayer:
+    """Cached picture of the board and its idle cells as the camera sees them.
+
+    The layer covers the viewport. It is redrawn in full when the camera moves or zooms and after
+    invalidate(), and one cell at a time for the cells passed to cellChanged(), those placed,
+    removed or with a new picture. Cells the water is running through are left out of it and kept
+    in active, to be drawn on top every frame, so a frame costs one blit of the layer plus the
+    active cells instead of every piece on screen.
+    """
+    def __init__(self, camera):
+        self.camera = camera
+        self.surface = None
+        self.key = None
+        self.pattern = None
+        self.patternKey = None
+        self.tiles = None
+        self.changed = []
+        self.active = set()
+
+    def invalidate(self):
+        self.key = None
+
+    def cellChanged(self, row, col):
+        self.changed.append((row, col))
+
+    def _build_pattern(self, cellsize):
+        """Bakes a checkered patch covering the viewport plus two cells, starting on a dark cell, so
+        it can be scrolled by up to two cells and tiles seamlessly"""
+        viewport = self.camera.viewport
+        rows = viewport.height // cellsize + 3
+        cols = viewport.width // cellsize + 3
+        self.tiles = {type: scaledImage(BOARD[type][0], cellsize) for type in ("Dark", "Light")}
+        self.pattern = pygame.Surface((cols * cellsize, rows * cellsize))
+        for row in range(rows):
+            for col in range(cols):
+                type = "Dark" if (row + col) % 2 == 0 else "Light"
+                self.pattern.blit(self.tiles[type], (col * cellsize, row * cellsize))
+        self.patternKey = (cellsize, viewport.size)
+
+    def _layerPos(self, row, col):
+        x, y = self.camera.cellPos(row, col)
+        return x - self.camera.viewport.x, y - self.camera.viewport.y
+
+    def refresh(self, cells):
+        """Brings the layer up to date with the camera and the changed cells"""
+        camera = self.camera
+        key = (camera.x, camera.y, camera.cellSize, camera.viewport.size)
+        if key != self.key:
+            self._rebuild(cells)
+            self.key = key
+        else:
+            for row, col in self.changed:
+                self._redrawCell(cells, row, col)
+        self.changed.clear()
+
+    def _rebuild(self, cells):
+        camera = self.camera
+        viewport = camera.viewport
+        cellSize = camera.cellSize
+        if self.surface is None or self.surface.get_size() != viewport.size:
+            self.surface = pygame.Surface(viewport.size)
+        if self.patternKey != (cellSize, viewport.size):
+            self._build_pattern(cellSize)
+        surface = self.surface
+        surface.fill("Black")
+        surface.set_clip(camera.boardRect().move(-viewport.x, -viewport.y))
+        #  Align the patch to an even cell so the checkers match the board
+        surface.blit(self.pattern, self._layerPos(camera.y // cellSize // 2 * 2, camera.x // cellSize // 2 * 2))
+        surface.set_clip(None)
+        self.active = set()
+        rows, cols = camera.cellRange(viewport)
+        for row in rows:
+            for col in cols:
+                cell = cells.get(row, col)
+                if cell is None:
+                    continue
+                if cell.active:
+                    self.active.add((row, col))
+                else:
+                    pieceSprite(cell.piece, cellSize).draw(surface, cell, self._layerPos(row, col))
+
+    def _redrawCell(self, cells, row, col):
+        """Puts the board tile back under a cell and draws the cell on it unless it is active"""
+        camera = self.camera
+        viewport = camera.viewport
+        rect = camera.cellRect(row, col).clip(camera.boardRect())
+        if not rect:
+            self.active.discard((row, col))
+            return
+        pos = self._layerPos(row, col)
+        surface = self.surface
+        surface.set_clip(rect.move(-viewport.x, -viewport.y))
+        #  Board tiles have transparent pixels that show the black background, as on a rebuilt layer
+        surface.fill("Black")
+        surface.blit(self.tiles["Dark" if (row + col) % 2 == 0 else "Light"], pos)
+        cell = cells.get(row, col)
+        if cell is not None and cell.active:
+            self.active.add((row, col))
+        else:
+            self.active.discard((row, col))
+            if cell is not None:
+                pieceSprite(cell.piece, camera.cellSize).draw(surface, cell, pos)
+        surface.set_clip(None)
+
+    def draw(self, window, area):
+        viewport = self.camera.viewport
+        window.blit(self.surface, area, area.move(-viewport.x, -viewport.y))
+
+    def drawActive(self, window, cells, area):
+        camera = self.camera
+        for row, col in self.active:
+            cell = cells.get(row, col)
+            if cell is None:
+                continue
+            rect = camera.cellRect(row, col)
+            if area.colliderect(rect):
+                pieceSprite(cell.piece, camera.cellSize).draw(window, cell, rect.topleft)
 
 class PipeGamePlay:
-    def __init__(self):
-        self.rows = ROWS
-        self.cols = COLUMNS
+    def __init__(self, seed=None, profiler=None, rows=None, cols=None, saveScores=True):
+        self.rows = ROWS if rows is None else rows
+        self.cols = COLUMNS if cols is None else cols
+        #  Seed of the first game, later games get a new one
+        self.seed = seed
+
+        #  Ticked once per frame by Game.frame, so input, update and the replay log all see the
+        #  same game time within a frame
+        self.clock = GameClock(pygame.time.get_ticks, pygame.time.get_ticks())
+        self.profiler = FrameProfiler() if profiler is None else profiler
+        self.recorder = None
+        self.replaying = False
+        #  Whether a game over writes the top score file
+        self.saveScores = saveScores
+
+        self.sim = PipeSimulation(self.rows, self.cols, self.clock, seed=seed)
+        self.sim.topScore = loadTopScore()
+        self.camera = Camera(VIEWPORT, self.rows, self.cols)
+        self.layer = BoardLayer(self.camera)
 
         self.init_game()
         self.init_sounds()
 
-        self.timeRemain = 0
+        self.font = getFont(40)
+        self.smallFont = getFont(20)
 
-        self.newGame = True
-        self.gameOver = False
-        self.stageClear = False
-        self.stage = 0
-
-        self.topScore = loadTopScore()
-        self.Score = 500
-        self.time = self.startTime//1000
-
-        self.font = pygame.font.SysFont("Stencil", 40)
+        self.hudMessages = []
+        self.hudImages = []
 
     def init_game(self):
-        self.grid = self._create_game_grid()
-        self.pieces = {}
+        """Rebuilds the buttons for a freshly reset simulation"""
+        self.dirtyRects = [pygame.Rect(0, 0, SCREENWIDTH, SCREENHEIGHT)]
         self.buttons = [
             Button(self, "Ready", 110, 50, 30, 60, 640),
+            Button(self, "Hint", 110, 50, 30, 60, 800),
             Button(self, "New Game", 200, 50, 30, SCREENWIDTH//2, SCREENHEIGHT//2)
         ]
-        self.startTime = 30000
-        self.TIME = Timer(self.startTime)
-        self.TIME.activate()
-
-        self._insert_start_pieces(START, self._verify_start, StartPiece)
-        self._insert_start_pieces(END, self._verify_end, EndPiece)
-
-        self.nextPieces = [choice(list(PIPES.keys())) for _ in range(6)]
-        self.currentPiece = self.nextPieces.pop(0)
+        self.solver = None
+        self.hintCell = None
+        self.hintColor = None
+        self.hintMessage = ""
+        start = self.sim.startCell
+        self.camera.centerOn(start.row, start.col)
+        self.layer.invalidate()
 
     def init_sounds(self):
         pygame.mixer.init()
@@ -160,378 +501,381 @@ class PipeGamePlay:
         self.water = pygame.mixer.Sound("Assets/water.ogg")
         self.water.set_volume(0.2)
 
-    def _create_game_grid(self):
-        """Creates an empty game grid per the number of rows and columns"""
-        grid = []
-        for row in range(self.rows):
-            line = []
-            for col in range(self.cols):
-                line.append(" ")
-            grid.append(line)
-        return grid
-
-    def _insert_start_pieces(self, startpiecedict, verify_pos, newObject):
-        """Randomly select a Starting piece, then insert it into the grid in a valid position"""
-        piece = choice(list(startpiecedict.keys()))
-        validStartPos = False
-        row, col = 0, 0
-        while not validStartPos:
-            row, col = randint(0, self.rows - 1), randint(0, self.cols - 1)
-            validStartPos = verify_pos(piece, self.rows, self.cols, row, col)
-
-        self.pieces[(row, col)] = newObject(self, piece, row, col, XOFFSET, YOFFSET, self.startTime)
-        self.grid[row][col] = self.pieces[(row, col)].piece
-        return
-
-    def _verify_start(self, startpiece, rows, cols, row, col):
-        """Verify the starting location randomly selected"""
-        if startpiece == "SRIGHT" and col != cols - 1: return True
-        elif startpiece == "SLEFT" and col != 0: return True
-        elif startpiece == "SUP" and row != 0: return True
-        elif startpiece == "SDOWN" and row != rows - 1: return True
-        return False
-
-    def _verify_end(self, endpiece, rows, columns, row, col):
-        if self.grid[row][col] != " ": return False
-        if row == 0 and endpiece == "EDOWN": return False
-        elif row == rows - 1 and endpiece == "EUP": return False
-        elif col == 0 and endpiece == "ERIGHT": return False
-        elif col == columns - 1 and endpiece == "ELEFT": return False
-        else:
-            if row < rows - 1:
-                if self.grid[row + 1][col] != " ": return False
-                if col < columns - 1:
-                    if self.grid[row][col + 1] != " ": return False
-                if col > 0:
-                    if self.grid[row][col - 1] != " ": return False
-            if row > 0:
-                if self.grid[row - 1][col] != " ": return False
-        return True
-
     def reset_game(self):
         self.init_game()
-        self.buttons.pop(1)
-        self._check_newgame_or_newstage()
-        self._update_time_per_newgame_newstage()
-
-    def _check_newgame_or_newstage(self):
-        if self.gameOver:
-            self.timeRemain = 0
-            self.stage = 0
-            self.startTime = 30000 - (1000 * self.stage)
-        if self.stageClear:
-            self.stage += 1
-            self.startTime = 30000 - (1000 * self.stage)
-
-    def _update_time_per_newgame_newstage(self):
-        self.TIME.duration = self.startTime + self.timeRemain
-        self.time = self.startTime + self.timeRemain
-        self.timeRemain = 0
-        self.startTime = self.time
-        self.TIME.activate()
-        self.TIME.current_time = 0
-
-    def draw_game_board(self, window):
-        for row in range(self.rows):
-            for col in range(self.cols):
-                if row % 2 == 0:
-                    type = "Dark" if col % 2 == 0 else "Light"
-                else:
-                    type = "Light" if col % 2 == 0 else "Dark"
-                window.blit(BOARD[type][0], (XOFFSET + (col * 64), YOFFSET + (row * 64)))
+        self.buttons.remove(self._button("New Game"))
+
+    def _button(self, text):
+        for button in self.buttons:
+            if button.text == text:
+                return button
+        return None
+
+    def control_clock(self, key):
+        """P pauses, [ and ] halve and double the speed, . steps one frame while paused"""
+        clock = self.clock
+        if key == pygame.K_p:
+            if clock.paused:
+                clock.resume()
+            else:
+                clock.pause()
+        elif key == pygame.K_LEFTBRACKET:
+            clock.speed = max(clock.speed / 2, MINSPEED)
+        elif key == pygame.K_RIGHTBRACKET:
+            clock.speed = min(clock.speed * 2, MAXSPEED)
+        elif key == pygame.K_PERIOD and clock.paused and not self.replaying:
+            clock.advance(FRAMESTEP)
+            if self.recorder is not None:
+                self.recorder.frame(clock.now)
+
+    def _record(self, action, arg=0):
+        if self.recorder is not None:
+            self.recorder.record(action, arg)
+
+    def ready(self):
+        self._record("ready")
+        self.sim.ready()
+
+    def next_stage(self):
+        self._record("next_stage")
+        self.profiler.mark("next_stage")
+        self.sim.next_stage()
+        self.reset_game()
+
+    def new_game(self, seed=None):
+        self.sim.new_game(self.seed if seed is None else seed)
+        self._record("new_game", self.sim.seed)
+        self.profiler.mark("new_game")
+        self.seed = None
+        self.reset_game()
+
+    def hint(self):
+        """Starts searching for the next move, spread over the following frames by update()"""
+        sim = self.sim
+        if sim.newGame or sim.gameOver or sim.stageClear or self.solver is not None:
+            return
+        self.clear_hint()
+        self.solver = Solver.fromSimulation(sim)
+        self.hintMessage = "Thinking..."
+
+    def _show_hint(self, solver):
+        moves = solver.moves
+        if moves is None:
+            self.hintMessage = "No route"
+        elif not moves:
+            self.hintMessage = "Press Ready"
+        else:
+            move = moves[0]
+            if move[0] == "place":
+                self.hintMessage = "Place here"
+                self.hintColor = "Green"
+                cell = move[1:3]
+            elif move[0] == "remove":
+                self.hintMessage = "Remove"
+                self.hintColor = "Red"
+                cell = move[1:3]
+            else:
+                self.hintMessage = "Discard"
+                self.hintColor = "Orange"
+                cell = solver.discardCell()
+            if cell is not None:
+                self.hintCell = cell
+                self.markDirty(self._cell_rect(*cell))
+
+    def clear_hint(self):
+        if self.hintCell is not None:
+            self.markDirty(self._cell_rect(*self.hintCell))
+        self.solver = None
+        self.hintCell = None
+        self.hintMessage = ""
+
+    def scroll(self, dx, dy):
+        if self.camera.scroll(dx, dy):
+            self.markDirty(self.camera.viewport)
+
+    def zoom(self, step, focus=None):
+        """Moves step levels through ZOOMS, keeping the board point under focus in place"""
+        level = min(max(ZOOMS.index(self.camera.cellSize) + step, 0), len(ZOOMS) - 1)
+        if self.camera.zoom(ZOOMS[level], focus):
+            self.markDirty(self.camera.viewport)
+
+    def _cell_rect(self, row, col):
+        """Visible screen area of a cell, empty when scrolled out of view"""
+        return self.camera.cellRect(row, col).clip(self.camera.viewport)
+
+    def _preview_rect(self):
+        return pygame.Rect(XOFFSET - 128, 64, 128, YOFFSET + 194 + (64 * len(self.sim.nextPieces)) - 64)
 
     def draw_current_next_pieces(self, window):
-        window.blit(pygame.transform.scale(PIPES[self.currentPiece][0], (128, 128)), (XOFFSET - 128, 64))
+        window.blit(PREVIEW[self.sim.currentPiece][0], (XOFFSET - 128, 64))
         pygame.draw.rect(window, "White", (XOFFSET - 128, 64, 128, 128), 1)
-        for num, item in enumerate(self.nextPieces):
+        for num, item in enumerate(self.sim.nextPieces):
             window.blit(PIPES[item][0], (XOFFSET - 96, YOFFSET + 194 + (64 * num)))
         return
 
-    def _get_row_and_col(self, xpos, ypos, xoffset, yoffset):
-        row = (ypos - yoffset) // CELLSIZE
-        col = (xpos - xoffset) // CELLSIZE
-        return row, col
+    def _get_row_and_col(self, xpos, ypos):
+        return self.camera.cellAt(xpos, ypos)
+
+    def insert_new_piece(self, xpos, ypos):
+        self.place(*self._get_row_and_col(xpos, ypos))
+
+    def removePiece(self, xpos, ypos):
+        self.remove(*self._get_row_and_col(xpos, ypos))
+
+    def place(self, row, col):
+        if self.sim.grid.inside(row, col):
+            self._record("place", cellArg(row, col))
+            self.sim.insert_new_piece(row, col)
+
+    def remove(self, row, col):
+        if self.sim.grid.inside(row, col):
+            self._record("remove", cellArg(row, col))
+            self.sim.removePiece(row, col)
+
+    def handle_events(self):
+        """Applies the changes reported by the simulation to the sprites, sounds and top score"""
+        for event in self.sim.events:
+            kind = event[0]
+            if kind == "place":
+                self.layer.cellChanged(event[1], event[2])
+                self.markDirty(self._cell_rect(event[1], event[2]))
+                self.markDirty(self._preview_rect())
+                self.clear_hint()
+            elif kind == "remove":
+                self.layer.cellChanged(event[1], event[2])
+                self.markDirty(self._cell_rect(event[1], event[2]))
+                self.clear_hint()
+            elif kind == "cell":
+                self.layer.cellChanged(event[1], event[2])
+                self.markDirty(self._cell_rect(event[1], event[2]))
+            elif kind == "flow":
+                self.profiler.mark("flow")
+                if not self.waterPlaying:
+                    self.waterPlaying = True
+                    self.water.play(-1)
+            elif kind == "stage_clear":
+                self.profiler.mark("stage_clear")
+                self.clear_hint()
+                self.waterPlaying = False
+                self.water.fadeout(500)
+            elif kind == "game_over":
+                self.profiler.mark("game_over")
+                self.clear_hint()
+                if self.saveScores:
+                    saveTopScore(self.sim.topScore, self.sim.Score)
+                self.waterPlaying = False
+                self.water.fadeout(500)
+        self.sim.events.clear()
 
-    def insert_new_piece(self, xpos, ypos, xoffset, yoffset):
-        row, col = self._get_row_and_col(xpos, ypos, xoffset, yoffset)
-        if row < 0 or col < 0 or row >= self.rows or col >= self.cols:
-            return
+    def update(self):
+        self.sim.update()
+        self.handle_events()
 
-        #  Can change this code to allow for replacing current tiles: Remember to make a check for Start/end piece
-        if self.grid[row][col] != " ":
+        if self.sim.newGame:
             return
 
-        self.grid[row][col] = self.currentPiece
-        self.pieces[(row, col)] = Piece(self, self.currentPiece, row, col, xoffset, yoffset)
-
-        self.currentPiece = self.nextPieces.pop(0)
-        self.nextPieces.append(choice(list(PIPES.keys())))
+        if self.solver is not None and self.solver.run(HINTBUDGET):
+            self._show_hint(self.solver)
+            self.solver = None
+
+        if self.sim.stageClear and not self._button("Next Stage"):
+            self.buttons.append(Button(self, "Next Stage", 200, 50, 30, SCREENWIDTH//2, SCREENHEIGHT//2))
+            self.markDirty(self.buttons[-1].rect)
+
+        if self.sim.gameOver and not self._button("Game Over"):
+            self.buttons.append(Button(self, "Game Over", 200, 50, 30, SCREENWIDTH//2, SCREENHEIGHT//2))
+            self.markDirty(self.buttons[-1].rect)
+
+    def markDirty(self, rect):
+        """Records a screen area that has to be redrawn by the dirty rect renderer"""
+        rect = pygame.Rect(rect)
+        if rect and rect not in self.dirtyRects:
+            self.dirtyRects.append(rect)
+
+    def _hud(self):
+        path = self.sim.path
+        return [
+            (f"TIMER : {str(self.sim.time)}", (12, 12), self.font),
+            (f"Score : {str(self.sim.Score)}", (64*4, 12), self.font),
+            (f"Top Score : {str(self.sim.topScore)}", (64 * 9, 12), self.font),
+            (f"Pipe : {str(path.length)}", (8, 690), self.smallFont),
+            ("Connected" if path.connected else "", (8, 716), self.smallFont),
+            (self.hintMessage, (8, 742), self.smallFont),
+            (f"Seed : {self.sim.seed}", (XOFFSET, 840), self.smallFont),
+            (self._clock_label(), (XOFFSET + 260, 840), self.smallFont)
+        ]
 
-        self.Score -= 50
+    def _clock_label(self):
+        if self.clock.paused:
+            return "Paused"
+        if self.clock.speed != 1:
+            return f"Speed x{self.clock.speed:g}"
+        return ""
+
+    def _check_hud(self):
+        """Re-renders only the HUD labels whose text changed since the last frame and marks their area"""
+        hud = self._hud()
+        if len(hud) != len(self.hudMessages):
+            self.hudMessages = [None] * len(hud)
+            self.hudImages = [None] * len(hud)
+        for num, (message, pos, font) in enumerate(hud):
+            if message == self.hudMessages[num]:
+                continue
+            image = textImage(font, message)
+            rect = image.get_rect(topleft=pos)
+            if self.hudImages[num]:
+                self.markDirty(rect.union(self.hudImages[num][1]))
+            else:
+                self.markDirty(rect)
+            self.hudMessages[num] = message
+            self.hudImages[num] = (image, rect)
 
-    def removePiece(self, xpos, ypos, xoffset, yoffset):
-        row, col = self._get_row_and_col(xpos, ypos, xoffset, yoffset)
-        if row < 0 or col < 0 or row >= self.rows or col >= self.cols:
-            return
+    def draw_hud(self, window, area=None):
+        for image, rect in self.hudImages:
+            if area is None or area.colliderect(rect):
+                window.blit(image, rect)
 
-        if self.grid[row][col] in [" ", 'SRIGHT', 'SLEFT', 'SUP', 'SDOWN', 'ERIGHT', 'ELEFT', 'EUP', 'EDOWN']:
-            return
+    def draw_game_board(self, window, area):
+        """Copies a visible board area from the layer of the board and idle cells"""
+        self.layer.draw(window, area)
 
-        self.grid[row][col] = " "
-        del self.pieces[(row, col)]
+    def draw_pieces(self, window, area):
+        """Draws the active cells, which the layer leaves out, over a visible board area"""
+        self.layer.drawActive(window, self.sim.pieces, area)
 
-    def update(self):
-        if self.newGame:
+    def draw_hint(self, window, area=None):
+        if self.hintCell is None:
             return
+        rect = self.camera.cellRect(*self.hintCell)
+        if area is None or area.colliderect(rect):
+            pygame.draw.rect(window, self.hintColor, rect, 3)
 
-        if self.TIME.active:
-            self.TIME.update()
-            self.time = self.startTime//1000 + ((self.TIME.start_time // 1000) - (self.TIME.current_time//1000))
-
-        if self.time <= 0:
-            self.TIME.deactivate()
-
-        if self.stageClear and len(self.buttons) < 2:
-            self.buttons.append(Button(self, "Next Stage", 200, 50, 30, game.sw//2, game.sh//2))
-
-        if self.gameOver and len(self.buttons) < 2:
-            self.buttons.append(Button(self, "Game Over", 200, 50, 30, game.sw//2, game.sh//2))
-
-        for value in self.pieces.values():
-            value.update()
+    def draw_buttons(self, window, area=None):
+        for button in self.buttons:
+            if area is None or area.colliderect(button.rect):
+                button.draw(window)
 
     def draw(self, window):
-        window.blit(textImage(self.font, f"TIMER : {str(self.time)}"), (12, 12))
-        window.blit(textImage(self.font, f"Score : {str(self.Score)}"), (64*4, 12))
-        window.blit(textImage(self.font, f"Top Score : {str(self.topScore)}"), (64 * 9, 12))
+        profiler = self.profiler
+        start = perf_counter()
+        self._check_hud()
+        self.dirtyRects = []
 
-        self.draw_game_board(window)
+        self.draw_hud(window)
+        start = profiler.lap("hud", start)
         self.draw_current_next_pieces(window)
-        for piece in self.pieces.values():
-            piece.draw(window)
-
-        if self.buttons:
-            for button in self.buttons:
-                button.draw(window)
+        start = profiler.lap("preview", start)
+        board = self.camera.boardRect()
+        self.layer.refresh(self.sim.pieces)
+        window.set_clip(board)
+        self.draw_game_board(window, board)
+        start = profiler.lap("board", start)
+        self.draw_pieces(window, board)
+        start = profiler.lap("pieces", start)
+        self.draw_hint(window, board)
+        window.set_clip(None)
+        start = profiler.lap("hint", start)
+        self.draw_buttons(window)
+        profiler.lap("buttons", start)
+
+    def draw_dirty(self, window):
+        """Redraws only the areas marked dirty since the last frame and returns them"""
+        profiler = self.profiler
+        start = perf_counter()
+        self._check_hud()
+        rects, self.dirtyRects = self.dirtyRects, []
+        start = profiler.lap("hud", start)
+
+        boardRect = self.camera.boardRect()
+        self.layer.refresh(self.sim.pieces)
+        previewRect = self._preview_rect()
+        for rect in rects:
+            window.set_clip(rect)
+            window.fill("Black")
+            start = profiler.lap("board", start)
+            self.draw_hud(window, rect)
+            start = profiler.lap("hud", start)
+            if rect.colliderect(previewRect):
+                self.draw_current_next_pieces(window)
+            start = profiler.lap("preview", start)
+            board = rect.clip(boardRect)
+            if board:
+                window.set_clip(board)
+                self.draw_game_board(window, board)
+                start = profiler.lap("board", start)
+                self.draw_pieces(window, board)
+                start = profiler.lap("pieces", start)
+                self.draw_hint(window, board)
+                start = profiler.lap("hint", start)
+                window.set_clip(rect)
+            self.draw_buttons(window, rect)
+            start = profiler.lap("buttons", start)
+        window.set_clip(None)
+        return rects
 
 class StartPiece:
-    def __init__(self, game, piece, row, column, xoffset, yoffset, starttime):
-        self.game = game
-        self.piece = piece
-        self.row = row
-        self.col = column
-        self.xPos = xoffset + (self.col * CELLSIZE)
-        self.yPos = yoffset + (self.row * CELLSIZE)
-        self.imgIndex = 0
-
-        self.image = START[self.piece][self.imgIndex]
-        self.rect = self.image.get_rect(topleft=(self.xPos, self.yPos))
+    """Sprite shared by every start piece of one direction, drawing the animation frame of a cell"""
+    __slots__ = ("frames",)
 
-        self.timer = Timer(starttime)
-        self.timer.activate()
+    def __init__(self, piece, size):
+        self.frames = [scaledImage(frame, size) for frame in START[piece]]
 
-        self.active = True
-        self.direction = self.piece[1:]
-
-    def update(self):
-        if not self.active:
-            return
-
-        self.timer.update()
-
-        if self.timer.active == False and self.imgIndex < (len(START[self.piece])-1):
-            self.updateImageAnimation()
-            self.resetTimer(FLOWTIME)
-            if not self.game.waterPlaying:
-                self.game.waterPlaying = True
-                self.game.water.play(-1)
-
-        if self.imgIndex == len(START[self.piece]) - 1 and self.active == True:
-            self.active = False
-            currentPiece = {
-                "SRIGHT": ["RIGHT", self.row, self.col+1, ["LR-RL", "LT-TL", "LB-BL"]],
-                "SLEFT": ["LEFT", self.row, self.col-1, ["LR-RL", "RT-TR", "RB-BR"]],
-                "SUP": ["UP", self.row-1, self.col, ["TB-BT", "LB-BL", "RB-BR"]],
-                "SDOWN": ["DOWN", self.row+1, self.col, ["TB-BT", "LT-TL", "RT-TR"]]
-            }
-            for piece in currentPiece.keys():
-                if self.piece == piece:
-                    self.direction = currentPiece[piece][0]
-                    row, col = currentPiece[piece][1], currentPiece[piece][2]
-                    if self.game.grid[row][col] in currentPiece[piece][3]:
-                        self.game.pieces[(row, col)].calcFlowDirection(self.direction)
-                        self.game.pieces[(row, col)].active = True
-                        return
-            self.failState()
-
-    def updateImageAnimation(self):
-        """Changes the image to reflect the updated animation image"""
-        self.imgIndex += 1
-        self.image = START[self.piece][self.imgIndex]
-
-    def failState(self):
-        self.game.gameOver = True
-        saveTopScore(self.game.topScore, self.game.Score)
-        self.game.waterPlaying = False
-        self.game.water.fadeout(500)
-
-    def resetTimer(self, duration):
-        """Resets the timer with a new time"""
-        self.timer.duration = duration
-        self.timer.activate()
-
-    def draw(self, window):
-        window.blit(self.image, self.rect)
+    def draw(self, window, cell, pos):
+        window.blit(self.frames[cell.imgIndex], pos)
 
 class EndPiece:
-    def __init__(self, game, piece, row, column, xoffset, yoffset, *args):
-        self.game = game
-        self.piece = piece
-        self.row = row
-        self.col = column
-        self.xPos = xoffset + (self.col * CELLSIZE)
-        self.yPos = yoffset + (self.row * CELLSIZE)
-        self.end = "END"
-
-        self.image = END[self.piece][0]
-        self.rect = self.image.get_rect(topleft=(self.xPos, self.yPos))
+    """Sprite shared by every end piece of one direction"""
+    __slots__ = ("image",)
 
-    def update(self):
-        pass
+    def __init__(self, piece, size):
+        self.image = scaledImage(END[piece][0], size)
 
-    def draw(self, window):
-        window.blit(self.image, self.rect)
+    def draw(self, window, cell, pos):
+        window.blit(self.image, pos)
 
 class Piece:
-    def __init__(self, game, piece, row, col, xoffset, yoffset):
-        self.game = game
-        self.piece = piece
-        self.row = row
-        self.col = col
-        self.xPos = xoffset + (self.col * CELLSIZE)
-        self.yPos = yoffset + (self.row * CELLSIZE)
-        self.imgIndex = 0
-
-        self.image = PIPES[self.piece][0].convert_alpha()
-        self.rect = self.image.get_rect(topleft=(self.xPos, self.yPos))
-
-        self.timer = None
-
-        self.active = False
-        self.direction = None
-        self.animImage = None
-        self.start1 = True
-        self.start2 = True
-
-    def update(self):
-        if not self.active:
-            return
-
-        self.timer.update()
-
-        if self.timer.active == False and self.imgIndex < (len(FLOW[self.direction]) - 1):
-            self.updateImageAnimation()
-            self.resetTimer(FLOWTIME)
-
-        if self.imgIndex == len(FLOW[self.direction]) - 1 and self.active == True:
-            self._calculate_next_piece_direction()
-
-    def _calculate_next_piece_direction(self):
-        self.active = False
-        newCell = {
-            ("LR", "TR", "BR"): [self.row, self.col + 1, "ERIGHT", ["LR-RL", "LT-TL", "LB-BL"]],
-            ("RL", "TL", "BL"): [self.row, self.col - 1, "ELEFT", ["LR-RL", "RT-TR", "RB-BR"]],
-            ("BT", "LT", "RT"): [self.row - 1, self.col, "EUP", ["TB-BT", "LB-BL", "RB-BR"]],
-            ("TB", "LB", "RB"): [self.row + 1, self.col, "EDOWN", ["TB-BT", "LT-TL", "RT-TR"]]
-        }
-        for flowDirection in newCell.keys():
-            if self.direction in flowDirection:
-                row, col = newCell[flowDirection][0], newCell[flowDirection][1]
-                endPiece = newCell[flowDirection][2]
-                nextPiece = newCell[flowDirection][3]
-
-                if self.game.grid[row][col] == endPiece:
-                    self.winstate()
-                    print("Pipes Complete")
-                    return
-                if self.game.grid[row][col] in nextPiece:
-                    self.updateNextPiece(row, col)
-                    return
-        self.failState()
-
-    def updateNextPiece(self, row, col):
-        self.game.Score += 100
-        self.game.pieces[(row, col)].calcFlowDirection(self.direction)
-        self.game.pieces[(row, col)].active = True
-
-    def winstate(self):
-        self.game.Score += 1000
-        self.game.stageClear = True
-        self.game.waterPlaying = False
-        self.game.water.fadeout(500)
-
-    def failState(self):
-        self.game.gameOver = True
-        saveTopScore(self.game.topScore, self.game.Score)
-        self.game.waterPlaying = False
-        self.game.water.fadeout(500)
-
-    def resetTimer(self, duration):
-        """Resets the timer with a new time"""
-        self.timer.duration = duration
-        self.timer.activate()
-        if self.start1:
-            self.start1 = False
-            return
-        if not self.start1 and self.start2 == True:
-            self.start2 = False
-
-    def calcFlowDirection(self, lastDirection):
-        cellDirect = {
-            ("UP", "BT", "RT", "LT"): [["TB-BT", "LB-BL", "RB-BR"], {"TB-BT": "BT", "LB-BL": "BL", "RB-BR": "BR"}],
-            ("DOWN", "TB", "RB", "LB"): [["TB-BT", "LT-TL", "RT-TR"], {"TB-BT": "TB", "LT-TL": "TL", "RT-TR": "TR"}],
-            ("RIGHT", "LR", "TR", "BR"): [["LR-RL", "LB-BL", "LT-TL"], {"LR-RL": "LR", "LB-BL": "LB", "LT-TL": "LT"}],
-            ("LEFT", "RL", "TL", "BL"): [["LR-RL", "RB-BR", "RT-TR"], {"LR-RL": "RL", "RB-BR": "RB", "RT-TR": "RT"}]
-        }
-        for celldir in cellDirect.keys():
-            if lastDirection in celldir and self.piece in cellDirect[celldir][0]:
-                self.direction = cellDirect[celldir][1][self.piece]
-
-        self.timer = Timer(FLOWTIME)
-
-    def updateImageAnimation(self):
-        """Changes the image to reflect the updated water flow animation"""
-        if self.start1 != True and self.start2 == True:
-            self.animIndex = 0
-        if self.start2 != True and self.start2 != True:
-            self.imgIndex += 1
-        if not self.start1 or not self.start2:
-            self.animImage = FLOW[self.direction][self.imgIndex]
-
-    def draw(self, window):
-        if self.animImage:
-            window.blit(self.animImage, self.rect)
-        window.blit(self.image, self.rect)
-
-class Timer:
-    def __init__(self, duration):
-        self.duration = duration
-        self.start_time = 0
-        self.active = False
-        self.current_time = 0
-
-    def activate(self):
-        self.active = True
-        self.start_time = pygame.time.get_ticks()
-
-    def deactivate(self):
-        self.active = False
-        self.start_time = 0
-
-    def update(self):
-        self.current_time = pygame.time.get_ticks()
-        if self.current_time - self.start_time >= self.duration:
-            self.deactivate()
+    """Sprite shared by every pipe of one type, drawing the water under it once it flows"""
+    __slots__ = ("image", "flow")
+
+    def __init__(self, piece, size):
+        self.image = scaledImage(PIPES[piece][0], size)
+        self.flow = flowFrames(size)
+
+    def draw(self, window, cell, pos):
+        if cell.animIndex is not None:
+            window.blit(self.flow[cell.direction][cell.animIndex], pos)
+        window.blit(self.image, pos)
+
+def pieceSprite(piece, size=None):
+    """The one sprite of a piece name at a cell size, the default one if not given, created on first use"""
+    size = CELLSIZE if size is None else size
+    sprite = SPRITES.get((piece, size))
+    if sprite is None:
+        if piece in START:
+            sprite = StartPiece(piece, size)
+        elif piece in END:
+            sprite = EndPiece(piece, size)
+        else:
+            sprite = Piece(piece, size)
+        SPRITES[(piece, size)] = sprite
+    return sprite
+
+def flowFrames(size):
+    """Water animation frames at a cell size, shared by every pipe sprite of that size"""
+    frames = FLOWFRAMES.get(size)
+    if frames is None:
+        frames = {direction: [scaledImage(frame, size) for frame in images] for direction, images in FLOW.items()}
+        FLOWFRAMES[size] = frames
+    return frames
+
+def scaledImage(image, size):
+    """image scaled to size x size, images already that size are returned as they are"""
+    if image.get_width() == size:
+        return image
+    scaled = pygame.transform.scale(image, (size, size))
+    if image.get_colorkey() is not None:
+        scaled.set_colorkey(image.get_colorkey(), pygame.RLEACCEL)
+    return scaled
 
 class Button:
     def __init__(self, game, text, width, height, fontsize, xpos, ypos):
@@ -542,7 +886,7 @@ class Button:
         self.fontsize = fontsize
         self.xPos = xpos
         self.yPos = ypos
-        self.font = pygame.font.SysFont("Stencil", self.fontsize)
+        self.font = getFont(self.fontsize)
 
         self.image = self.buttonGenerator()
         self.rect = self.image.get_rect(topleft=(self.xPos-(self.image.get_width()//2), self.yPos-(self.image.get_height()//2)))
@@ -558,31 +902,16 @@ class Button:
 
     def buttonAction(self):
         if self.text == "Ready":
-            for piece in self.game.pieces.values():
-                if piece.piece[0] == "S":
-                    piece.timer.deactivate()
-            if self.game.time == 0:
-                return
-            if self.game.newGame:
-                return
-            self.game.timeRemain = self.game.time * 1000
-            self.game.time = 0
-            self.game.TIME.deactivate()
+            self.game.ready()
+
+        if self.text == "Hint":
+            self.game.hint()
 
         if self.text == "Next Stage":
-            self.game.reset_game()
-            self.game.stageClear = False
+            self.game.next_stage()
 
         if self.text == "Game Over" or self.text == "New Game":
-            self.game.startTime = 30000
-            self.game.reset_game()
-
-            if self.game.Score > self.game.topScore:
-                self.game.topScore = self.game.Score
-
-            self.game.Score = 500
-            self.game.gameOver = False
-            self.game.newGame = False
+            self.game.new_game()
 
     def draw(self, window):
         window.blit(self.image, self.rect)
@@ -592,55 +921,105 @@ class Button:
 SCREENWIDTH = 960
 SCREENHEIGHT = 896
 IMAGESIZE = (64, 64)
+PREVIEWSIZE = (128, 128)
 ROWS = 12
 COLUMNS = 12
+#  Largest board the command line accepts, a million cells still generate in a few frames
+MAXBOARD = 1000
 CELLSIZE = 64
-FLOWTIME = 50
+ZOOMS = (16, 24, 32, 48, 64, 96)
 XOFFSET = 128
 YOFFSET = 64
+FPS = 60
+IDLEFPS = 10
+DIRTYRECTS = True
+HINTBUDGET = 4
+PROFILEREFRESH = 500
+FRAMESTEP = 1000 // FPS
+VIEWPORT = (XOFFSET, YOFFSET, COLUMNS * CELLSIZE, ROWS * CELLSIZE)
+SCROLLKEYS = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0), pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+MINSPEED = 0.125
+MAXSPEED = 128
+
+FONTFAMILY = "Stencil"
+
+TEXTCACHE = TextCache()
+SPRITES = {}
+FLOWFRAMES = {}
+FONTS = FontCache()
 
 #  Assets
-START = {
-    "SRIGHT": loadImages("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE),
-    "SLEFT": loadImages("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, 180),
-    "SUP":   loadImages("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, 90),
-    "SDOWN":   loadImages("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, -90)
-}
-END = {
-    "ERIGHT": loadImages("Assets/pipe_end.png", 1, 1, True, IMAGESIZE),
-    "ELEFT":   loadImages("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, 180),
-    "EUP":   loadImages("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, 90),
-    "EDOWN":   loadImages("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, -90)
-}
-PIPES = {
-    "LR-RL": loadImages("Assets/horizontal/pipe_horizontal.png", 1, 1, True, IMAGESIZE,simg=True),
-    "TB-BT": loadImages("Assets/vertical/pipe_vertical.png", 1, 1, True, IMAGESIZE,simg=True),
-    "LT-TL": loadImages("Assets/top_left/pipe_corner_top_left.png", 1, 1, True, IMAGESIZE,simg=True),
-    "LB-BL": loadImages("Assets/bottom_left/pipe_corner_bottom_left.png", 1, 1, True, IMAGESIZE,simg=True),
-    "RT-TR": loadImages("Assets/top_right/pipe_corner_top_right.png", 1, 1, True, IMAGESIZE,simg=True),
-    "RB-BR": loadImages("Assets/bottom_right/pipe_corner_bottom_right.png", 1, 1, True, IMAGESIZE,simg=True)
+ASSETSPECS = {
+    "START": {
+        "SRIGHT": ("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE),
+        "SLEFT": ("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, 180),
+        "SUP":   ("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, 90),
+        "SDOWN":   ("Assets/pipe_start_strip11.png", 11, 1, True, IMAGESIZE, True, -90)
+    },
+    "END": {
+        "ERIGHT": ("Assets/pipe_end.png", 1, 1, True, IMAGESIZE),
+        "ELEFT":   ("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, 180),
+        "EUP":   ("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, 90),
+        "EDOWN":   ("Assets/pipe_end.png", 1, 1, True, IMAGESIZE, True, -90)
+    },
+    "PIPES": {
+        "LR-RL": ("Assets/horizontal/pipe_horizontal.png", 1, 1, True, IMAGESIZE, False, 0, True),
+        "TB-BT": ("Assets/vertical/pipe_vertical.png", 1, 1, True, IMAGESIZE, False, 0, True),
+        "LT-TL": ("Assets/top_left/pipe_corner_top_left.png", 1, 1, True, IMAGESIZE, False, 0, True),
+        "LB-BL": ("Assets/bottom_left/pipe_corner_bottom_left.png", 1, 1, True, IMAGESIZE, False, 0, True),
+        "RT-TR": ("Assets/top_right/pipe_corner_top_right.png", 1, 1, True, IMAGESIZE, False, 0, True),
+        "RB-BR": ("Assets/bottom_right/pipe_corner_bottom_right.png", 1, 1, True, IMAGESIZE, False, 0, True)
+    },
+    "FLOW": {
+        "LR": ("Assets/horizontal/water_horizontal_left_strip11.png", 11, 1, True),
+        "RL": ("Assets/horizontal/water_horizontal_right_strip11.png", 11, 1, True),
+        "TB": ("Assets/vertical/water_vertical_top_strip11.png", 11, 1, True),
+        "BT": ("Assets/vertical/water_vertical_bottom_strip11.png", 11, 1, True),
+        "LT": ("Assets/top_left/water_corner_top_left_left_strip11.png", 11, 1, True),
+        "TL": ("Assets/top_left/water_corner_top_left_top_strip11.png", 11, 1, True),
+        "LB": ("Assets/bottom_left/water_corner_bottom_left_left_strip11.png", 11, 1, True),
+        "BL": ("Assets/bottom_left/water_corner_bottom_left_bottom_strip11.png", 11, 1, True),
+        "RT": ("Assets/top_right/water_corner_top_right_right_strip11.png", 11, 1, True),
+        "TR": ("Assets/top_right/water_corner_top_right_top_strip11.png", 11, 1, True),
+        "RB": ("Assets/bottom_right/water_corner_bottom_right_right_strip11.png", 11, 1, True),
+        "BR": ("Assets/bottom_right/water_corner_bottom_right_bottom_strip11.png", 11, 1, True)
+    },
+    "BOARD": {
+        "Dark": ("Assets/board/BoardDark.png", 1, 1, True),
+        "Light": ("Assets/board/BoardLight.png", 1, 1, True)
+    },
+    "PREVIEW": {
+        "LR-RL": ("Assets/horizontal/pipe_horizontal.png", 1, 1, True, PREVIEWSIZE, False, 0, True),
+        "TB-BT": ("Assets/vertical/pipe_vertical.png", 1, 1, True, PREVIEWSIZE, False, 0, True),
+        "LT-TL": ("Assets/top_left/pipe_corner_top_left.png", 1, 1, True, PREVIEWSIZE, False, 0, True),
+        "LB-BL": ("Assets/bottom_left/pipe_corner_bottom_left.png", 1, 1, True, PREVIEWSIZE, False, 0, True),
+        "RT-TR": ("Assets/top_right/pipe_corner_top_right.png", 1, 1, True, PREVIEWSIZE, False, 0, True),
+        "RB-BR": ("Assets/bottom_right/pipe_corner_bottom_right.png", 1, 1, True, PREVIEWSIZE, False, 0, True)
+    }
 }
-FLOW = {
-    "LR": loadImages("Assets/horizontal/water_horizontal_left_strip11.png", 11, 1, True),
-    "RL": loadImages("Assets/horizontal/water_horizontal_right_strip11.png", 11, 1, True),
-    "TB": loadImages("Assets/vertical/water_vertical_top_strip11.png", 11, 1, True),
-    "BT": loadImages("Assets/vertical/water_vertical_bottom_strip11.png", 11, 1, True),
-    "LT": loadImages("Assets/top_left/water_corner_top_left_left_strip11.png", 11, 1, True),
-    "TL": loadImages("Assets/top_left/water_corner_top_left_top_strip11.png", 11, 1, True),
-    "LB": loadImages("Assets/bottom_left/water_corner_bottom_left_left_strip11.png", 11, 1, True),
-    "BL": loadImages("Assets/bottom_left/water_corner_bottom_left_bottom_strip11.png", 11, 1, True),
-    "RT": loadImages("Assets/top_right/water_corner_top_right_right_strip11.png", 11, 1, True),
-    "TR": loadImages("Assets/top_right/water_corner_top_right_top_strip11.png", 11, 1, True),
-    "RB": loadImages("Assets/bottom_right/water_corner_bottom_right_right_strip11.png", 11, 1, True),
-    "BR": loadImages("Assets/bottom_right/water_corner_bottom_right_bottom_strip11.png", 11, 1, True)
-}
-BOARD = {
-    "Dark": loadImages("Assets/board/BoardDark.png", 1, 1, True),
-    "Light": loadImages("Assets/board/BoardLight.png", 1, 1, True)
-}
-
+ASSETS = AssetRegistry(ASSETSPECS)
+START = ASSETS["START"]
+END = ASSETS["END"]
+PIPES = ASSETS["PIPES"]
+FLOW = ASSETS["FLOW"]
+BOARD = ASSETS["BOARD"]
+PREVIEW = ASSETS["PREVIEW"]
 
 if __name__=='__main__':
-    game = Game()
+    parser = argparse.ArgumentParser(description="Pipes")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the first game")
+    parser.add_argument("--record", default=None, help="write the input of the session to this log")
+    parser.add_argument("--replay", default=None, help="play an input log back in real time")
+    parser.add_argument("--profile", default=None, help="write per frame phase timings to this CSV file")
+    parser.add_argument("--speed", type=float, default=1.0, help="game clock speed multiplier")
+    parser.add_argument("--rows", type=int, default=ROWS, help="board rows, scrolled with the arrow keys")
+    parser.add_argument("--cols", type=int, default=COLUMNS, help="board columns")
+    args = parser.parse_args()
+    if args.seed is not None and not 0 <= args.seed < SEEDRANGE:
+        parser.error(f"--seed has to be in 0..{SEEDRANGE - 1}")
+    if not (0 < args.rows <= MAXBOARD and 0 < args.cols <= MAXBOARD):
+        parser.error(f"--rows and --cols have to be in 1..{MAXBOARD}")
+    game = Game(seed=args.seed, record=args.record, replay=args.replay, profile=args.profile, speed=args.speed,
+                rows=args.rows, cols=args.cols)
     game.runGame()
     pygame.quit()
@@ -0,0 +1,73 @@
+"""Per frame timings of the game loop phases with rolling percentiles.
+
+Each frame is opened with begin() and closed with end(). In between, lap(phase, start) adds the
+time since start to a phase and returns the current time, so consecutive phases are timed with
+one perf_counter call each. Phases called several times in a frame, like the draw phases of the
+dirty rect renderer, add up. mark() tags the frame with what happened in it (flow started, stage
+reset, ...) so spikes can be matched to events in the CSV.
+"""
+import csv
+from collections import deque
+from time import perf_counter
+
+PHASES = ["clock", "input", "update", "hud", "board", "preview", "pieces", "hint", "buttons", "display"]
+WINDOW = 300
+PERCENTILES = (50, 95, 99)
+
+def percentile(values, pct):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+class FrameProfiler:
+    """Rolling window of phase timings, optionally writing every frame to a CSV file in ms"""
+    def __init__(self, window=WINDOW, csvpath=None):
+        self.samples = {phase: deque(maxlen=window) for phase in PHASES + ["frame"]}
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.marks = []
+        self.frame = 0
+        self.frameStart = perf_counter()
+        self.file = None
+        if csvpath is not None:
+            self.file = open(csvpath, "w", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["frame"] + PHASES + ["frame_ms", "events"])
+
+    def begin(self):
+        self.frameStart = perf_counter()
+        return self.frameStart
+
+    def lap(self, phase, start):
+        now = perf_counter()
+        self.current[phase] += now - start
+        return now
+
+    def mark(self, label):
+        self.marks.append(label)
+
+    def end(self):
+        total = perf_counter() - self.frameStart
+        for phase, seconds in self.current.items():
+            self.samples[phase].append(seconds)
+            self.current[phase] = 0.0
+        self.samples["frame"].append(total)
+        if self.file is not None:
+            row = [self.frame] + [f"{self.samples[phase][-1] * 1000:.3f}" for phase in PHASES]
+            self.writer.writerow(row + [f"{total * 1000:.3f}", " ".join(self.marks)])
+        self.marks.clear()
+        self.frame += 1
+
+    def summary(self):
+        """{phase: (p50, p95, p99)} in ms over the window"""
+        result = {}
+        for phase, values in self.samples.items():
+            ordered = sorted(values)
+            result[phase] = tuple(percentile(ordered, pct) * 1000 for pct in PERCENTILES)
+        return result
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
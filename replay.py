@@ -0,0 +1,151 @@
+"""Input logs of played sessions and their playback.
+
+A log holds the board size and seed followed by one fixed size record per action: the frame time
+it happened at, the time since the frame before, the action and its argument (row * 65536 + col
+for cells, the seed for a new game). Boards can be up to MAXSIZE cells wide and tall. Actions are
+applied to the simulation in the same order and at the same times as in the session, with an
+update at the frame time before each, so a replay ends in exactly the same state.
+
+    python replay.py session.pipr       # replays as fast as possible without a window
+    python main.py --replay session.pipr   # replays in real time
+"""
+import argparse
+import struct
+from time import perf_counter
+
+from simulation import PipeSimulation, SimClock, SEEDRANGE
+
+MAGIC = b"PIPR"
+VERSION = 2
+HEADER = struct.Struct("<4sBHHII")
+RECORD = struct.Struct("<IHBI")
+ACTIONS = ["place", "remove", "ready", "next_stage", "new_game", "end"]
+ACTIONCODES = {action: code for code, action in enumerate(ACTIONS)}
+MAXGAP = 0xFFFF
+MAXSIZE = 0xFFFF
+
+class Recorder:
+    """Writes the actions of a session to a log as they happen"""
+    def __init__(self, path, rows, cols, seed, start):
+        if not (0 < rows <= MAXSIZE and 0 < cols <= MAXSIZE):
+            raise ValueError(f"a {rows}x{cols} board does not fit an input log, "
+                             f"at most {MAXSIZE}x{MAXSIZE}")
+        if not 0 <= seed < SEEDRANGE:
+            raise ValueError(f"seed {seed} does not fit an input log, "
+                             f"it has to be in 0..{SEEDRANGE - 1}")
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, rows, cols, seed, start))
+        self.frameTime = start
+        self.previousTime = start
+
+    def frame(self, time):
+        """Marks the start of a frame at time, after the update of the frame before"""
+        self.previousTime = self.frameTime
+        self.frameTime = time
+
+    def record(self, action, arg=0):
+        gap = min(self.frameTime - self.previousTime, MAXGAP)
+        self.file.write(RECORD.pack(self.frameTime, gap, ACTIONCODES[action], arg))
+
+    def close(self):
+        self.record("end")
+        self.file.close()
+
+def cellArg(row, col):
+    return row * 65536 + col
+
+class Replay:
+    """A recorded session, fed back into a target with place, remove, ready, next_stage and
+    new_game methods"""
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, self.rows, self.cols, self.seed, self.start = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} input log")
+        self.records = list(RECORD.iter_unpack(data[HEADER.size:]))
+        self.position = 0
+        self.frameTime = None
+
+    @property
+    def finished(self):
+        return self.position >= len(self.records)
+
+    @property
+    def nextUpdate(self):
+        """Frame time of the update the next recorded action followed"""
+        if self.finished:
+            return float("inf")
+        time, gap, _, _ = self.records[self.position]
+        return time - gap
+
+    @property
+    def end(self):
+        """Frame time of the last record"""
+        return self.records[-1][0] if self.records else self.start
+
+    def feed(self, target, sim, until):
+        """Applies the recorded actions up to time until, setting sim.clock to their frame times"""
+        clock = sim.clock
+        while self.position < len(self.records) and self.records[self.position][0] <= until:
+            time, gap, code, arg = self.records[self.position]
+            self.position += 1
+            if time != self.frameTime:
+                clock.now = max(clock.now, time - gap)
+                sim.update()
+                clock.now = time
+                self.frameTime = time
+            action = ACTIONS[code]
+            if action in ("place", "remove"):
+                getattr(target, action)(arg // 65536, arg % 65536)
+            elif action == "new_game":
+                target.new_game(arg)
+            elif action != "end":
+                getattr(target, action)()
+
+class SimulationTarget:
+    """Replay target applying actions straight to a simulation"""
+    def __init__(self, sim):
+        self.sim = sim
+
+    def place(self, row, col):
+        self.sim.insert_new_piece(row, col)
+
+    def remove(self, row, col):
+        self.sim.removePiece(row, col)
+
+    def ready(self):
+        self.sim.ready()
+
+    def next_stage(self):
+        self.sim.next_stage()
+
+    def new_game(self, seed):
+        self.sim.new_game(seed)
+
+def replay(path, rules=None):
+    """Plays a log back without a window as fast as possible and returns the simulation"""
+    log = Replay(path)
+    sim = PipeSimulation(log.rows, log.cols, SimClock(log.start), rules, log.seed)
+    target = SimulationTarget(sim)
+    log.feed(target, sim, log.end)
+    sim.events.clear()
+    sim.update()
+    return sim
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an input log without a window")
+    parser.add_argument("log")
+    args = parser.parse_args()
+
+    began = perf_counter()
+    sim = replay(args.log)
+    elapsed = perf_counter() - began
+    played = sim.clock.ticks() - Replay(args.log).start
+    print(f"seed {sim.seed} stage {sim.stage} score {sim.Score} game over {sim.gameOver} "
+          f"failReason {sim.failReason}")
+    speedup = played / 1000 / max(elapsed, 1e-9)
+    print(f"{played / 1000:.1f} s of play replayed in {elapsed * 1000:.1f} ms ({speedup:.0f}x)")
+
+if __name__ == '__main__':
+    main()
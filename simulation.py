@@ -0,0 +1,534 @@
+"""Pure Python rules of the pipes game: grid, piece queue, water flow and scoring.
+
+Nothing here imports pygame. Time comes from a clock object with a ticks() method returning
+milliseconds of game time, normally a GameClock fed from pygame's ticks or a SimClock that is
+advanced explicitly. Things the view has to react to are appended to PipeSimulation.events.
+
+All randomness comes from a random.Random per game seeded with PipeSimulation.seed, so a seed
+reproduces the same boards and piece queue.
+"""
+from heapq import heappush, heappop
+from random import Random, randrange
+
+from flowpath import FlowPath
+from grid import TileGrid, TRANSITIONS, STARTTRANSITIONS, ARRIVED, TILECODES, CONNECTIONS, OFFSETS, SIDES, isPipe
+from solver import canConnect
+
+STARTTIME = 30000
+STAGETIME = 1000
+FLOWTIME = 50
+STARTFRAMES = 11
+FLOWFRAMES = 11
+
+STARTSCORE = 500
+PLACESCORE = -50
+PIPESCORE = 100
+WINSCORE = 1000
+
+STARTPIECES = ["SRIGHT", "SLEFT", "SUP", "SDOWN"]
+ENDPIECES = ["ERIGHT", "ELEFT", "EUP", "EDOWN"]
+PIPEPIECES = ["LR-RL", "TB-BT", "LT-TL", "LB-BL", "RT-TR", "RB-BR"]
+SEEDRANGE = 1 << 32
+#  Random end cells tried around the start before going through the whole board, and the states
+#  the reachability check of each may expand per cell of distance
+ENDTRIES = 100
+ENDSEARCH = 16
+
+def pieceStream(rng):
+    """Endless queue of the pipe pieces dealt in a game"""
+    while True:
+        yield rng.choice(PIPEPIECES)
+
+def facingRange(piece, rows, cols):
+    """(rows, cols) ranges of the cells where the opening of a start or end piece faces into the board"""
+    dRow, dCol = OFFSETS[CONNECTIONS[TILECODES[piece]]]
+    return range(max(0, -dRow), rows - max(0, dRow)), range(max(0, -dCol), cols - max(0, dCol))
+
+class GameClock:
+    """The one clock of a game, in milliseconds of game time.
+
+    tick() advances it by the real time that passed since the last tick, read from source (a
+    function returning real milliseconds) and multiplied by speed. While paused, or without a
+    source, it only moves when advanced by hand with advance(). Everything in the simulation reads
+    ticks(), which returns the time of the last tick, so all objects agree on the time of a frame.
+    """
+    def __init__(self, source=None, start=0, speed=1.0):
+        self.source = source
+        self.now = start
+        self.speed = speed
+        self.paused = False
+        self.real = source() if source is not None else 0
+        self.carry = 0.0
+
+    def ticks(self):
+        return self.now
+
+    def tick(self):
+        """Moves game time on by the scaled real time since the last tick"""
+        if self.source is None:
+            return self.now
+        real = self.source()
+        elapsed, self.real = real - self.real, real
+        if not self.paused:
+            self.carry += elapsed * self.speed
+            whole = int(self.carry)
+            self.carry -= whole
+            self.now += whole
+        return self.now
+
+    def advance(self, ms):
+        """Steps game time on by hand, paused or not"""
+        self.now += ms
+        return self.now
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.carry = 0.0
+
+class SimClock(GameClock):
+    """Game clock without a real time source, that only moves when advanced"""
+    def __init__(self, start=0):
+        super().__init__(None, start)
+
+class Timer:
+    def __init__(self, clock, duration, end_time=None):
+        self.clock = clock
+        self.duration = duration
+        self.start_time = 0
+        self.active = False
+        self.current_time = 0
+        self.end_time = clock.ticks() if end_time is None else end_time
+
+    def activate(self, start_time=None):
+        """Starts the timer now, or from an earlier deadline so that chained timers do not drift"""
+        self.active = True
+        self.start_time = self.clock.ticks() if start_time is None else start_time
+
+    def deactivate(self, end_time=None):
+        self.active = False
+        self.start_time = 0
+        self.end_time = self.clock.ticks() if end_time is None else end_time
+
+    def update(self):
+        self.current_time = self.clock.ticks()
+        if self.active and self.current_time - self.start_time >= self.duration:
+            self.deactivate(self.start_time + self.duration)
+
+class Scheduler:
+    """Priority queue of timed wake ups so only the cell the water is in gets updated.
+
+    Scheduling a cell again replaces its previous wake up; stale entries are skipped when popped.
+    """
+    def __init__(self):
+        self.queue = []
+        self.count = 0
+
+    def schedule(self, time, cell):
+        cell.wakeTime = time
+        heappush(self.queue, (time, self.count, cell))
+        self.count += 1
+
+    def due(self, now):
+        """Yields (time, cell) for every wake up at or before now, in time order"""
+        while self.queue and self.queue[0][0] <= now:
+            time, _, cell = heappop(self.queue)
+            if cell.wakeTime == time:
+                cell.wakeTime = None
+                yield time, cell
+
+class CellStore:
+    """Cell objects of the pieces on the board in a flat list indexed by row * cols + col, None for
+    empty cells. Callers check that (row, col) is on the board"""
+    __slots__ = ("cols", "cells", "count")
+
+    def __init__(self, rows, cols):
+        self.cols = cols
+        self.cells = [None] * (rows * cols)
+        self.count = 0
+
+    def get(self, row, col):
+        return self.cells[row * self.cols + col]
+
+    def put(self, row, col, cell):
+        index = row * self.cols + col
+        if self.cells[index] is None:
+            self.count += 1
+        self.cells[index] = cell
+        return cell
+
+    def pop(self, row, col):
+        index = row * self.cols + col
+        cell = self.cells[index]
+        if cell is not None:
+            self.cells[index] = None
+            self.count -= 1
+        return cell
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        return (cell for cell in self.cells if cell is not None)
+
+    def items(self):
+        """((row, col), cell) for every piece, row by row"""
+        return (((cell.row, cell.col), cell) for cell in self.cells if cell is not None)
+
+class Rules:
+    """Timing and score constants of a game, overridable for balancing runs.
+
+    The end piece is placed minDistance + distanceStep * stage to maxDistance cells (Manhattan
+    distance) away from the start piece when the board has room for that.
+    """
+    def __init__(self, startTime=STARTTIME, stageTime=STAGETIME, flowTime=FLOWTIME, startScore=STARTSCORE,
+                 placeScore=PLACESCORE, pipeScore=PIPESCORE, winScore=WINSCORE, minDistance=0,
+                 maxDistance=None, distanceStep=0):
+        self.startTime = startTime
+        self.stageTime = stageTime
+        self.flowTime = flowTime
+        self.startScore = startScore
+        self.placeScore = placeScore
+        self.pipeScore = pipeScore
+        self.winScore = winScore
+        self.minDistance = minDistance
+        self.maxDistance = maxDistance
+        self.distanceStep = distanceStep
+
+class PipeSimulation:
+    """Game state and rules for one player, advanced by calling update()"""
+    def __init__(self, rows, cols, clock=None, rules=None, seed=None):
+        self.rows = rows
+        self.cols = cols
+        self.clock = SimClock() if clock is None else clock
+        self.rules = Rules() if rules is None else rules
+
+        self.timeRemain = 0
+
+        self.newGame = True
+        self.gameOver = False
+        self.stageClear = False
+        self.stage = 0
+
+        self._seed(seed)
+        self.init_game()
+
+        self.topScore = 0
+        self.Score = self.rules.startScore
+        self.failReason = None
+        self.time = self.startTime//1000
+
+    def init_game(self):
+        self.events = []
+        self.scheduler = Scheduler()
+        self.grid = self._create_game_grid()
+        self.pieces = CellStore(self.rows, self.cols)
+        self.startTime = self.rules.startTime
+        self.TIME = Timer(self.clock, self.startTime)
+        self.TIME.activate()
+
+        self.startCell = self._insert_start_piece()
+        self.endCell = self._insert_end_piece()
+        self.path = FlowPath(self.grid, self.startCell)
+
+        self.nextPieces = [next(self.pieceQueue) for _ in range(6)]
+        self.currentPiece = self.nextPieces.pop(0)
+
+    def _seed(self, seed):
+        """Starts the random generator and piece queue of a game, from a new seed when none is given"""
+        self.seed = randrange(SEEDRANGE) if seed is None else seed
+        self.rng = Random(self.seed)
+        self.pieceQueue = pieceStream(self.rng)
+
+    def _create_game_grid(self):
+        """Creates an empty game grid per the number of rows and columns"""
+        return TileGrid(self.rows, self.cols)
+
+    def _add_piece(self, newObject, piece, row, col):
+        self.grid.setName(row, col, piece)
+        return self.pieces.put(row, col, newObject(self, piece, row, col, self.startTime))
+
+    def _insert_start_piece(self):
+        """Puts a random start piece on a random cell it does not point off the board from"""
+        piece = self.rng.choice(STARTPIECES)
+        rows, cols = facingRange(piece, self.rows, self.cols)
+        row, col = self.rng.choice(rows), self.rng.choice(cols)
+        return self._add_piece(StartCell, piece, row, col)
+
+    def _insert_end_piece(self):
+        """Puts a random end piece where it faces into the board, has no pieces around it and the
+        water from the start piece can be led into it, preferring the distance range of the stage.
+
+        Cells at a random distance in the range are tried first, which only looks at the cells
+        around each; small or crowded boards where none of those fit fall back to every cell.
+        """
+        start = self.startCell
+        rng = self.rng
+        low, high = self._end_distance()
+        for _ in range(ENDTRIES):
+            piece = rng.choice(ENDPIECES)
+            distance = rng.randint(low, high)
+            dRow = rng.randint(-distance, distance)
+            dCol = (distance - abs(dRow)) * rng.choice((-1, 1))
+            row, col = start.row + dRow, start.col + dCol
+            rows, cols = facingRange(piece, self.rows, self.cols)
+            if row in rows and col in cols and self._end_fits(row, col) \
+                    and self._end_reachable(piece, row, col, ENDSEARCH * (distance + 1)):
+                return self._add_piece(EndCell, piece, row, col)
+
+        piece = rng.choice(ENDPIECES)
+        pieces = [piece] + [other for other in ENDPIECES if other != piece]
+        for inRange in (True, False):
+            for piece in pieces:
+                rows, cols = facingRange(piece, self.rows, self.cols)
+                candidates = [(row, col) for row in rows for col in cols
+                              if self._end_fits(row, col)
+                              and (not inRange or low <= abs(row - start.row) + abs(col - start.col) <= high)]
+                while candidates:
+                    index = rng.randrange(len(candidates))
+                    row, col = candidates[index]
+                    if self._end_reachable(piece, row, col):
+                        return self._add_piece(EndCell, piece, row, col)
+                    candidates[index] = candidates[-1]
+                    candidates.pop()
+        raise ValueError(f"no room for an end piece on a {self.rows}x{self.cols} board")
+
+    def _end_reachable(self, piece, row, col, limit=None):
+        start = self.startCell
+        return canConnect(self.grid, start.row + start.dRow, start.col + start.dCol, start.exit,
+                          row, col, SIDES[piece[1:]], limit)
+
+    def _end_distance(self):
+        """(min, max) start to end distance for the stage the board is being built for. reset_game
+        builds the board before it counts the stage, so a cleared stage means the next one"""
+        if self.gameOver:
+            stage = 0
+        elif self.stageClear:
+            stage = self.stage + 1
+        else:
+            stage = self.stage
+        rules = self.rules
+        high = self.rows + self.cols if rules.maxDistance is None else rules.maxDistance
+        return min(rules.minDistance + rules.distanceStep * stage, high), high
+
+    def _end_fits(self, row, col):
+        """Whether a cell and the cells next to it are all empty"""
+        grid = self.grid
+        if not grid.isEmpty(row, col):
+            return False
+        for dRow, dCol in OFFSETS.values():
+            if grid.inside(row + dRow, col + dCol) and not grid.isEmpty(row + dRow, col + dCol):
+                return False
+        return True
+
+    def gridAt(self, row, col):
+        """Piece name at a cell, or None outside of the board"""
+        return self.grid.name(row, col)
+
+    def passWater(self, cell, time, score=0):
+        """Hands the water leaving a cell on to its neighbour at time, ending the stage if it cannot get in"""
+        row, col = cell.row + cell.dRow, cell.col + cell.dCol
+        transition = TRANSITIONS[cell.exit][self.grid.get(row, col)]
+        if transition is None:
+            self.failState(row, col)
+        elif transition[0] == ARRIVED:
+            self.winstate()
+        else:
+            self.Score += score
+            self.pieces.get(row, col).calcFlowDirection(transition, time)
+
+    def reset_game(self):
+        self.init_game()
+        self._check_newgame_or_newstage()
+        self._update_time_per_newgame_newstage()
+
+    def _check_newgame_or_newstage(self):
+        if self.gameOver:
+            self.timeRemain = 0
+            self.stage = 0
+            self.startTime = self.rules.startTime - (self.rules.stageTime * self.stage)
+        if self.stageClear:
+            self.stage += 1
+            self.startTime = self.rules.startTime - (self.rules.stageTime * self.stage)
+
+    def _update_time_per_newgame_newstage(self):
+        self.TIME.duration = self.startTime + self.timeRemain
+        self.time = self.startTime + self.timeRemain
+        self.timeRemain = 0
+        self.startTime = self.time
+        self.TIME.activate()
+        self.TIME.current_time = 0
+        self.scheduler.schedule(self.TIME.start_time + self.startTime, self.startCell)
+
+    def insert_new_piece(self, row, col):
+        """Places the current piece on an empty cell, returns whether it was placed"""
+        if not self.grid.isEmpty(row, col):
+            return False
+
+        self.grid.setName(row, col, self.currentPiece)
+        self.pieces.put(row, col, PipeCell(self, self.currentPiece, row, col))
+        self.path.update(row, col)
+        self.events.append(("place", row, col))
+
+        self.currentPiece = self.nextPieces.pop(0)
+        self.nextPieces.append(next(self.pieceQueue))
+
+        self.Score += self.rules.placeScore
+        return True
+
+    def removePiece(self, row, col):
+        """Removes a placed pipe the water has not reached yet"""
+        if not isPipe(self.grid.get(row, col)):
+            return False
+        if self.pieces.get(row, col).direction is not None:
+            return False
+
+        self.grid.setName(row, col, " ")
+        self.pieces.pop(row, col)
+        self.path.update(row, col)
+        self.events.append(("remove", row, col))
+        return True
+
+    def ready(self):
+        """Skips the rest of the countdown, banking the remaining time for the next stage"""
+        if self.startCell.active:
+            self.scheduler.schedule(self.clock.ticks(), self.startCell)
+        if self.time == 0:
+            return
+        if self.newGame:
+            return
+        self.timeRemain = self.time * 1000
+        self.time = 0
+        self.TIME.deactivate()
+
+    def next_stage(self):
+        self.reset_game()
+        self.stageClear = False
+
+    def new_game(self, seed=None):
+        """Starts a game from seed, or from a new seed when none is given"""
+        self._seed(seed)
+        self.startTime = self.rules.startTime
+        self.reset_game()
+
+        if self.Score > self.topScore:
+            self.topScore = self.Score
+
+        self.Score = self.rules.startScore
+        self.failReason = None
+        self.gameOver = False
+        self.newGame = False
+
+    def update(self):
+        if self.newGame:
+            return
+
+        if self.TIME.active:
+            self.TIME.update()
+            self.time = self.startTime//1000 + ((self.TIME.start_time // 1000) - (self.TIME.current_time//1000))
+
+        if self.time <= 0:
+            self.TIME.deactivate()
+
+        for time, cell in self.scheduler.due(self.clock.ticks()):
+            cell.wake(time)
+
+    def winstate(self):
+        self.Score += self.rules.winScore
+        self.stageClear = True
+        self.events.append(("stage_clear",))
+
+    def failState(self, row, col):
+        """Ends the game as the water could not flow into the given cell"""
+        value = self.gridAt(row, col)
+        if value is None:
+            self.failReason = "edge"
+        elif value == " ":
+            self.failReason = "leak"
+        else:
+            self.failReason = "blocked"
+        self.gameOver = True
+        self.events.append(("game_over", self.failReason))
+
+class StartCell:
+    __slots__ = ("game", "piece", "row", "col", "imgIndex", "flowStart", "active", "exit", "dRow", "dCol", "wakeTime")
+
+    def __init__(self, game, piece, row, column, starttime):
+        self.game = game
+        self.piece = piece
+        self.row = row
+        self.col = column
+        self.imgIndex = 0
+        self.flowStart = None
+
+        self.active = True
+        self.exit, self.dRow, self.dCol, _ = STARTTRANSITIONS[TILECODES[piece]]
+        game.scheduler.schedule(game.clock.ticks() + starttime, self)
+
+    def wake(self, time):
+        """Moves on to the next frame of the start animation, handing the water on after the last one"""
+        if self.imgIndex == 0:
+            self.flowStart = time
+            self.game.events.append(("flow",))
+        self.imgIndex += 1
+        self.game.events.append(("cell", self.row, self.col))
+
+        if self.imgIndex < STARTFRAMES - 1:
+            self.game.scheduler.schedule(time + self.game.rules.flowTime, self)
+            return
+
+        self.active = False
+        self.game.passWater(self, time)
+
+class EndCell:
+    __slots__ = ("game", "piece", "row", "col", "active", "end")
+
+    def __init__(self, game, piece, row, column, *args):
+        self.game = game
+        self.piece = piece
+        self.row = row
+        self.col = column
+        self.active = False
+        self.end = "END"
+
+class PipeCell:
+    __slots__ = ("game", "piece", "row", "col", "imgIndex", "animIndex", "flowStep", "active", "direction",
+                 "exit", "dRow", "dCol", "wakeTime")
+
+    def __init__(self, game, piece, row, col):
+        self.game = game
+        self.piece = piece
+        self.row = row
+        self.col = col
+        self.imgIndex = 0
+        self.animIndex = None
+        self.flowStep = 0
+
+        self.active = False
+        self.direction = None
+
+    def calcFlowDirection(self, transition, starttime):
+        """Lets the water in at starttime, following a transition from grid.TRANSITIONS"""
+        self.exit, self.dRow, self.dCol, self.direction = transition
+        self.active = True
+        self.game.scheduler.schedule(starttime, self)
+
+    def wake(self, time):
+        """Moves on to the next frame of the water flow animation, handing the water on after the last one"""
+        if self.flowStep == 1:
+            self.animIndex = 0
+            self.game.events.append(("cell", self.row, self.col))
+        elif self.flowStep > 1:
+            self.imgIndex += 1
+            self.animIndex = self.imgIndex
+            self.game.events.append(("cell", self.row, self.col))
+        self.flowStep += 1
+
+        if self.imgIndex < FLOWFRAMES - 1:
+            self.game.scheduler.schedule(time + self.game.rules.flowTime, self)
+            return
+
+        self.active = False
+        self.game.passWater(self, time, self.game.rules.pipeScore)
@@ -0,0 +1,258 @@
+"""Searches for the piece placements that connect the water route to the end piece.
+
+The search continues from where the current route stops (simulation.path). Every step either
+follows a pipe that is already on the board, removes a pipe that does not fit, places the next
+piece of the queue, or discards that piece somewhere off the route. Pieces past the visible queue
+are unknown, so any pipe may be used for them. States are memoized by (cell, direction, queue
+index) and expanded best first by moves made plus the Manhattan distance to the end piece.
+
+A Solver can be run in slices with a time budget so the game never stalls a frame on it:
+
+    solver = Solver.fromSimulation(sim)
+    while not solver.run(budget=4):
+        ...  # next frame
+    solver.moves  # [("place", row, col, piece), ("discard", piece), ("remove", row, col), ...]
+
+    python solver.py --boards 1000   # checks that generated boards can be solved
+"""
+import argparse
+from heapq import heappush, heappop
+from time import perf_counter
+
+from flowpath import PIPESTEPS
+from grid import TRANSITIONS, ARRIVED, EMPTY, OFFBOARD, OFFSETS, OPPOSITE, SIDES, TILECODES, TILENAMES, FIRSTPIPE, LASTPIPE, isPipe
+
+PLACETIME = 500
+PIPECODES = list(range(FIRSTPIPE, LASTPIPE + 1))
+NOTIME = float("inf")
+#  Moves that take the water through a cell
+ROUTEMOVES = ("place", "follow")
+
+class Solver:
+    """Best first search from an open cell of the route to the end piece.
+
+    grid: TileGrid of the board, row/col/direction: the empty cell the water reaches next and its
+    direction of travel, endcell: (row, col, direction the water has to arrive in), queue: piece
+    names still to come, arrival: time the water reaches the open cell, removable: cells whose pipe
+    may be taken off, used: cells the route up to the open cell already runs through. With
+    placetime, each move takes that long and a pipe has to be down before the water reaches it.
+    """
+    def __init__(self, grid, row, col, direction, endcell, queue, arrival=NOTIME, now=0, flowtime=50,
+                 placetime=0, removable=(), used=()):
+        self.grid = grid
+        self.endRow, self.endCol, self.endDirection = endcell
+        #  Cell the last pipe has to be on to pour into the end piece
+        dRow, dCol = OFFSETS[OPPOSITE[self.endDirection]]
+        self.approach = (self.endRow + dRow, self.endCol + dCol)
+        self.queue = [TILECODES[piece] for piece in queue]
+        self.arrival = arrival
+        self.now = now
+        self.cellTime = PIPESTEPS * flowtime
+        self.placeTime = placetime
+        self.removable = set(removable)
+        self.used = set(used)
+
+        self.heap = []
+        self.best = {}
+        self.count = 0
+        self.nodes = 0
+        self.finished = False
+        self.moves = None
+        self.route = None
+        self._push(row, col, direction, 0, 0, 0, False, None, None)
+
+    @classmethod
+    def fromSimulation(cls, sim, placetime=PLACETIME):
+        """Solver for the current state of a PipeSimulation"""
+        path = sim.path
+        end = sim.endCell
+        endcell = (end.row, end.col, SIDES[end.piece[1:]])
+        start = sim.startCell
+        flowStart = start.flowStart if start.flowStart is not None else start.wakeTime
+        arrival = path.flowSchedule(flowStart, sim.rules.flowTime)[1]
+        #  Pipes of the route are kept: taking one off would cut the water off before the open cell
+        used = {(row, col) for row, col, _ in path.cells}
+        removable = [cell for cell, piece in sim.pieces.items()
+                     if isPipe(sim.grid.get(*cell)) and piece.direction is None and cell not in used]
+        row, col = path.nextCell
+        solver = cls(sim.grid.copy(), row, col, path.direction, endcell, [sim.currentPiece] + sim.nextPieces,
+                     arrival, sim.clock.ticks(), sim.rules.flowTime, placetime, removable, used)
+        if path.connected:
+            solver._finish([], [])
+        elif path.state == "edge":
+            solver._finish(None, None)
+        return solver
+
+    def _distance(self, row, col):
+        return abs(row - self.approach[0]) + abs(col - self.approach[1])
+
+    def _push(self, row, col, direction, queueIndex, moves, cells, cleared, parent, move):
+        node = (row, col, direction, queueIndex, moves, cells, cleared, parent, move)
+        heappush(self.heap, (moves + self._distance(row, col), self.count, node))
+        self.count += 1
+
+    def _onRoute(self, node, row, col):
+        """Whether the route leading to node already passes through (row, col)"""
+        if (row, col) in self.used:
+            return True
+        while node is not None:
+            move = node[8]
+            if move is not None and move[0] in ROUTEMOVES and move[1] == row and move[2] == col:
+                return True
+            node = node[7]
+        return False
+
+    def run(self, budget=None):
+        """Searches for at most budget milliseconds, returns whether the search is finished"""
+        deadline = None if budget is None else perf_counter() + budget / 1000
+        heap = self.heap
+        while not self.finished:
+            if not heap:
+                self._finish(None, None)
+                break
+            node = heappop(heap)[2]
+            self.nodes += 1
+            self._expand(node)
+            if deadline is not None and self.nodes % 64 == 0 and perf_counter() > deadline:
+                break
+        return self.finished
+
+    def _expand(self, node):
+        row, col, direction, queueIndex, moves, cells, cleared, parent, move = node
+        key = (row, col, direction, min(queueIndex, len(self.queue)), cleared)
+        if self.best.get(key, moves + 1) <= moves:
+            return
+        self.best[key] = moves
+
+        code = EMPTY if cleared else self.grid.get(row, col)
+        if code == OFFBOARD or self._onRoute(node, row, col):
+            return
+        arrival = self.arrival + cells * self.cellTime
+
+        if code != EMPTY:
+            transition = TRANSITIONS[direction][code]
+            if transition is not None and transition[0] == ARRIVED:
+                self._finishAt(node)
+            elif transition is not None:
+                exit, dRow, dCol, _ = transition
+                self._push(row + dRow, col + dCol, exit, queueIndex, moves, cells + 1, False, node, ("follow", row, col))
+            elif (row, col) in self.removable and self._inTime(moves + 1, arrival):
+                self._push(row, col, direction, queueIndex, moves + 1, cells, True, node, ("remove", row, col))
+            return
+
+        if not self._inTime(moves + 1, arrival):
+            return
+        pieces = [self.queue[queueIndex]] if queueIndex < len(self.queue) else PIPECODES
+        for piece in pieces:
+            transition = TRANSITIONS[direction][piece]
+            if transition is None:
+                continue
+            exit, dRow, dCol, _ = transition
+            self._push(row + dRow, col + dCol, exit, queueIndex + 1, moves + 1, cells + 1, False, node,
+                       ("place", row, col, TILENAMES[piece]))
+        if queueIndex < len(self.queue):
+            self._push(row, col, direction, queueIndex + 1, moves + 1, cells, cleared, node,
+                       ("discard", TILENAMES[self.queue[queueIndex]]))
+
+    def _inTime(self, moves, arrival):
+        return self.placeTime == 0 or self.now + moves * self.placeTime <= arrival
+
+    def _finishAt(self, node):
+        moves, route = [], []
+        while node is not None:
+            move = node[8]
+            if move is not None:
+                if move[0] in ROUTEMOVES:
+                    route.append(move[1:3])
+                if move[0] != "follow":
+                    moves.append(move)
+            node = node[7]
+        moves.reverse()
+        route.reverse()
+        self._finish(moves, route)
+
+    def _finish(self, moves, route):
+        self.finished = True
+        self.moves = moves
+        self.route = route
+        self.heap = []
+
+    def discardCell(self, grid=None):
+        """An empty cell of grid, the searched board by default, away from the route and the end
+        piece to drop unwanted pieces on"""
+        grid = self.grid if grid is None else grid
+        avoid = set(self.route or ()) | {(self.endRow, self.endCol), self.approach}
+        for row in range(grid.rows):
+            for col in range(grid.cols):
+                if grid.isEmpty(row, col) and all(abs(row - r) + abs(col - c) > 1 for r, c in avoid):
+                    return row, col
+        return None
+
+def solve(sim, budget=None, placetime=PLACETIME):
+    """Moves that connect the route of a simulation to its end piece, None if there are none or the
+    budget ran out first. An empty list means the route is already connected."""
+    solver = Solver.fromSimulation(sim, placetime)
+    solver.run(budget)
+    return solver.moves
+
+def canConnect(grid, row, col, direction, endrow, endcol, enddirection, limit=None):
+    """Whether water travelling in direction into the empty cell (row, col) can be led over empty
+    cells into the end piece at (endrow, endcol) with free choice of pieces, ignoring time. With a
+    limit, gives up and returns False after expanding that many (cell, direction) states"""
+    #  Shortest walks through empty cells never cross themselves, so a route exists whenever the end
+    #  can be reached over (cell, direction) states at all, in whatever order they are searched.
+    #  Expanding the states closest to the end first reaches it without searching the whole board
+    seen = {((row, col), direction)}
+    heap = [(abs(endrow - row) + abs(endcol - col), 0, row, col, direction)]
+    expanded = 0
+    while heap:
+        _, _, row, col, direction = heappop(heap)
+        expanded += 1
+        if limit is not None and expanded > limit:
+            return False
+        for piece in PIPECODES:
+            transition = TRANSITIONS[direction][piece]
+            if transition is None:
+                continue
+            exit, dRow, dCol, _ = transition
+            nextCell = (row + dRow, col + dCol)
+            #  The end cell may still be empty while the end piece is being placed; water can only
+            #  go into it, never through it
+            if nextCell == (endrow, endcol):
+                if exit == enddirection:
+                    return True
+                continue
+            if grid.get(*nextCell) == EMPTY and (nextCell, exit) not in seen:
+                seen.add((nextCell, exit))
+                distance = abs(endrow - nextCell[0]) + abs(endcol - nextCell[1])
+                heappush(heap, (distance, len(seen), nextCell[0], nextCell[1], exit))
+    return False
+
+def isSolvable(sim):
+    """Whether the board of a simulation can be connected at all with free choice of pieces, ignoring time"""
+    path = sim.path
+    if path.connected:
+        return True
+    if path.state != "open":
+        return False
+    end = sim.endCell
+    return canConnect(sim.grid, *path.nextCell, path.direction, end.row, end.col, SIDES[end.piece[1:]])
+
+def main():
+    from simulation import PipeSimulation
+    parser = argparse.ArgumentParser(description="Check that generated boards can be solved")
+    parser.add_argument("--boards", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=12)
+    parser.add_argument("--cols", type=int, default=12)
+    args = parser.parse_args()
+
+    sim = PipeSimulation(args.rows, args.cols)
+    unsolvable = 0
+    for _ in range(args.boards):
+        sim.init_game()
+        if not isSolvable(sim):
+            unsolvable += 1
+    print(f"{args.boards - unsolvable} of {args.boards} boards solvable")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import pytest
+
+from simulation import PipeSimulation
+from solver import isSolvable
+
+@pytest.mark.parametrize("size", [3, 4, 6, 12])
+def test_generated_boards_are_solvable(size):
+    sim = PipeSimulation(size, size)
+    unsolvable = []
+    for seed in range(500):
+        sim.new_game(seed)
+        if not isSolvable(sim):
+            unsolvable.append(seed)
+    assert unsolvable == []
@@ -0,0 +1,36 @@
+from random import Random
+
+import pytest
+
+from simulation import PipeSimulation, PIPEPIECES
+from solver import Solver
+
+def _clutteredBoard(seed, size=8, pipes=20):
+    """Simulation of a new game with pipes placed on random cells"""
+    sim = PipeSimulation(size, size, seed=seed)
+    sim.new_game(seed)
+    rng = Random(seed)
+    for _ in range(pipes):
+        sim.currentPiece = rng.choice(PIPEPIECES)
+        sim.insert_new_piece(rng.randrange(size), rng.randrange(size))
+    return sim
+
+def _apply(sim, moves):
+    for move in moves:
+        if move[0] == "place":
+            sim.currentPiece = move[3]
+            sim.insert_new_piece(move[1], move[2])
+        elif move[0] == "remove":
+            sim.removePiece(move[1], move[2])
+
+@pytest.mark.parametrize("seed", range(400))
+def test_moves_connect_without_cutting_the_route(seed):
+    sim = _clutteredBoard(seed)
+    route = [(row, col) for row, col, _ in sim.path.cells]
+    solver = Solver.fromSimulation(sim, placetime=0)
+    solver.run()
+    if not solver.moves:
+        return
+    assert not any(move[0] == "remove" and move[1:3] in route for move in solver.moves)
+    _apply(sim, solver.moves)
+    assert sim.path.connected